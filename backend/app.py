@@ -1,20 +1,38 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, request
 from flask_cors import CORS
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from sklearn.preprocessing import MinMaxScaler
 from statsmodels.tsa.arima.model import ARIMA
+from handlers import Fetch, Compute, guarded, captured, run_sync
+from upstream import UpstreamScheduler, UpstreamError, create_source, WARMUP
+from shared_store import SharedPriceStore
+from warmer import AnalyticsWarmer, MarketCalendar, WarmStore
+from metrics import (registry, stage, timed, record_error, current_route, default_metrics_dir, Counter, Gauge,
+                     SamplingProfiler, TimedJSONProvider, REQUEST_DURATION, REQUESTS, IN_FLIGHT, MODEL_FITS)
+import logging
+import os
+import time
 import warnings
 import json
 warnings.filterwarnings('ignore')
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app)
 
 user_predictions = {}
 
+WARM_PERIOD = '1y'
+WARM_BENCHMARK = 'SPY'
+WARM_PREDICT_PERIOD = '2y'
+WARM_PREDICT_PERIODS = 30
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
 def calculate_beta(stock_returns, market_returns):
     """计算Beta系数"""
     covariance = np.cov(stock_returns, market_returns)[0][1]
@@ -84,10 +102,13 @@ def arima_predict(data, periods=30):
     try:
         prices = data['Close'].values
         model = ARIMA(prices, order=(5, 1, 0))
-        model_fit = model.fit()
-        forecast = model_fit.forecast(steps=periods)
+        with stage('model_fit'):
+            model_fit = model.fit()
+        MODEL_FITS.inc(model='arima')
         
-        conf_int = model_fit.get_forecast(steps=periods).conf_int()
+        with stage('forecast'):
+            forecast = model_fit.forecast(steps=periods)
+            conf_int = model_fit.get_forecast(steps=periods).conf_int()
         
         return {
             'predictions': forecast.tolist(),
@@ -95,7 +116,8 @@ def arima_predict(data, periods=30):
             'upper_bound': conf_int.iloc[:, 1].tolist()
         }
     except Exception as e:
-        print(f"ARIMA预测错误: {e}")
+        logger.warning('ARIMA预测错误: %s', e)
+        record_error('arima')
         return None
 
 def lstm_predict(data, periods=30):
@@ -127,16 +149,19 @@ def lstm_predict(data, periods=30):
         ])
         
         model.compile(optimizer='adam', loss='mean_squared_error')
-        model.fit(X, y, batch_size=32, epochs=10, verbose=0)
+        with stage('model_fit'):
+            model.fit(X, y, batch_size=32, epochs=10, verbose=0)
+        MODEL_FITS.inc(model='lstm')
         
         predictions = []
         last_sequence = scaled_data[-look_back:].reshape(1, look_back, 1)
         
-        for _ in range(periods):
-            pred = model.predict(last_sequence, verbose=0)
-            predictions.append(pred[0, 0])
-            last_sequence = np.roll(last_sequence, -1, axis=1)
-            last_sequence[0, -1, 0] = pred[0, 0]
+        with stage('forecast'):
+            for _ in range(periods):
+                pred = model.predict(last_sequence, verbose=0)
+                predictions.append(pred[0, 0])
+                last_sequence = np.roll(last_sequence, -1, axis=1)
+                last_sequence[0, -1, 0] = pred[0, 0]
         
         predictions = scaler.inverse_transform(np.array(predictions).reshape(-1, 1)).flatten()
         
@@ -150,71 +175,13 @@ def lstm_predict(data, periods=30):
             'upper_bound': upper_bound.tolist()
         }
     except Exception as e:
-        print(f"LSTM预测错误: {e}")
+        logger.warning('LSTM预测错误: %s', e)
+        record_error('lstm')
         return None
 
-@app.route('/api/stock/<symbol>', methods=['GET'])
-def get_stock_data(symbol):
-    """获取股票数据"""
-    try:
-        period = request.args.get('period', '1y')
-        stock = yf.Ticker(symbol)
-        data = stock.history(period=period)
-        
-        if data.empty:
-            return jsonify({'error': '无法获取股票数据，请检查股票代码'}), 404
-        
-        info = stock.info
-        
-        chart_data = []
-        for date, row in data.iterrows():
-            chart_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'open': round(row['Open'], 2),
-                'high': round(row['High'], 2),
-                'low': round(row['Low'], 2),
-                'close': round(row['Close'], 2),
-                'volume': int(row['Volume'])
-            })
-        
-        return jsonify({
-            'symbol': symbol.upper(),
-            'name': info.get('longName', symbol),
-            'currency': info.get('currency', 'USD'),
-            'exchange': info.get('exchange', 'N/A'),
-            'sector': info.get('sector', 'N/A'),
-            'industry': info.get('industry', 'N/A'),
-            'market_cap': info.get('marketCap', 0),
-            'pe_ratio': info.get('trailingPE', 0),
-            'dividend_yield': info.get('dividendYield', 0),
-            'fifty_two_week_high': info.get('fiftyTwoWeekHigh', 0),
-            'fifty_two_week_low': info.get('fiftyTwoWeekLow', 0),
-            'current_price': round(data['Close'].iloc[-1], 2),
-            'price_change': round(data['Close'].iloc[-1] - data['Close'].iloc[-2], 2),
-            'price_change_percent': round((data['Close'].iloc[-1] - data['Close'].iloc[-2]) / data['Close'].iloc[-2] * 100, 2),
-            'chart_data': chart_data
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/risk/<symbol>', methods=['GET'])
-def get_risk_analysis(symbol):
-    """获取风险分析"""
-    try:
-        period = request.args.get('period', '1y')
-        benchmark = request.args.get('benchmark', 'SPY')
-        
-        stock = yf.Ticker(symbol)
-        stock_data = stock.history(period=period)
-        
-        market = yf.Ticker(benchmark)
-        market_data = market.history(period=period)
-        
-        if stock_data.empty:
-            return jsonify({'error': '无法获取股票数据'}), 404
-        
-        risk_metrics = calculate_risk_metrics(stock_data, market_data)
-        
+def build_risk_analysis(symbol, benchmark, stock_data, market_data):
+    """构建风险分析结果"""
+    with stage('returns'):
         returns = stock_data['Close'].pct_change().dropna()
         returns_distribution = {
             'values': returns.values.tolist()[-252:],
@@ -224,15 +191,19 @@ def get_risk_analysis(symbol):
             'kurtosis': round(returns.kurtosis(), 4)
         }
         
-        rolling_beta = []
-        window = 30
         stock_returns = stock_data['Close'].pct_change().dropna()
         market_returns = market_data['Close'].pct_change().dropna()
         
         min_len = min(len(stock_returns), len(market_returns))
         stock_returns = stock_returns[-min_len:]
         market_returns = market_returns[-min_len:]
+    
+    # 风险指标与滚动贝塔在同一个阶段内计算，每个请求只记录一次耗时
+    with stage('metrics'):
+        risk_metrics = calculate_risk_metrics(stock_data, market_data)
         
+        rolling_beta = []
+        window = 30
         for i in range(window, len(stock_returns)):
             beta = calculate_beta(
                 stock_returns.iloc[i-window:i].values,
@@ -242,521 +213,854 @@ def get_risk_analysis(symbol):
                 'date': stock_returns.index[i].strftime('%Y-%m-%d'),
                 'beta': round(beta, 4)
             })
-        
-        return jsonify({
-            'symbol': symbol.upper(),
-            'benchmark': benchmark,
-            'metrics': risk_metrics,
-            'returns_distribution': returns_distribution,
-            'rolling_beta': rolling_beta
+    
+    return {
+        'symbol': symbol.upper(),
+        'benchmark': benchmark,
+        'metrics': risk_metrics,
+        'returns_distribution': returns_distribution,
+        'rolling_beta': rolling_beta
+    }
+
+def build_predictions(symbol, data, periods=30, method='both'):
+    """构建预测结果"""
+    result = {
+        'symbol': symbol.upper(),
+        'last_price': round(data['Close'].iloc[-1], 2),
+        'last_date': data.index[-1].strftime('%Y-%m-%d'),
+        'prediction_dates': [(data.index[-1] + timedelta(days=i+1)).strftime('%Y-%m-%d') for i in range(periods)]
+    }
+    
+    if method in ['arima', 'both']:
+        arima_result = arima_predict(data, periods)
+        if arima_result:
+            result['arima'] = arima_result
+    
+    if method in ['lstm', 'both']:
+        lstm_result = lstm_predict(data, periods)
+        if lstm_result:
+            result['lstm'] = lstm_result
+    
+    return result
+
+@timed('metrics')
+def build_quantitative_analysis(symbol, data):
+    """构建量化细致分析结果"""
+    closes = data['Close']
+    returns = closes.pct_change().dropna()
+    
+    ma5 = closes.rolling(5).mean().iloc[-1]
+    ma10 = closes.rolling(10).mean().iloc[-1]
+    ma20 = closes.rolling(20).mean().iloc[-1]
+    ma60 = closes.rolling(60).mean().iloc[-1] if len(closes) >= 60 else None
+    
+    delta = closes.diff()
+    gain = (delta.where(delta > 0, 0)).rolling(14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
+    rs = gain / loss
+    rsi = 100 - (100 / (1 + rs)).iloc[-1]
+    
+    ema12 = closes.ewm(span=12).mean()
+    ema26 = closes.ewm(span=26).mean()
+    macd = ema12 - ema26
+    signal = macd.ewm(span=9).mean()
+    macd_hist = macd - signal
+    
+    bb_ma = closes.rolling(20).mean()
+    bb_std = closes.rolling(20).std()
+    bb_upper = bb_ma + 2 * bb_std
+    bb_lower = bb_ma - 2 * bb_std
+    
+    lowest_14 = closes.rolling(14).min()
+    highest_14 = closes.rolling(14).max()
+    k = 100 * (closes - lowest_14) / (highest_14 - lowest_14)
+    d = k.rolling(3).mean()
+    
+    skewness = returns.skew()
+    kurtosis = returns.kurtosis()
+    
+    current_price = closes.iloc[-1]
+    
+    signals = []
+    if current_price > ma5.item() if hasattr(ma5, 'item') else ma5:
+        signals.append({'type': 'bullish', 'indicator': 'MA5', 'desc': '价格在5日均线上方'})
+    else:
+        signals.append({'type': 'bearish', 'indicator': 'MA5', 'desc': '价格在5日均线下方'})
+    
+    rsi_val = rsi.item() if hasattr(rsi, 'item') else rsi
+    if rsi_val > 70:
+        signals.append({'type': 'bearish', 'indicator': 'RSI', 'desc': f'RSI={rsi_val:.1f} 超买区域'})
+    elif rsi_val < 30:
+        signals.append({'type': 'bullish', 'indicator': 'RSI', 'desc': f'RSI={rsi_val:.1f} 超卖区域'})
+    else:
+        signals.append({'type': 'neutral', 'indicator': 'RSI', 'desc': f'RSI={rsi_val:.1f} 中性区域'})
+    
+    macd_val = macd.iloc[-1]
+    signal_val = signal.iloc[-1]
+    if macd_val > signal_val:
+        signals.append({'type': 'bullish', 'indicator': 'MACD', 'desc': 'MACD金叉，看多信号'})
+    else:
+        signals.append({'type': 'bearish', 'indicator': 'MACD', 'desc': 'MACD死叉，看空信号'})
+    
+    return {
+        'symbol': symbol.upper(),
+        'current_price': round(current_price, 2),
+        'moving_averages': {
+            'ma5': round(ma5, 2),
+            'ma10': round(ma10, 2),
+            'ma20': round(ma20, 2),
+            'ma60': round(ma60, 2) if ma60 else None
+        },
+        'indicators': {
+            'rsi': round(rsi_val, 2),
+            'macd': round(macd.iloc[-1], 4),
+            'macd_signal': round(signal.iloc[-1], 4),
+            'macd_hist': round(macd_hist.iloc[-1], 4),
+            'kdj_k': round(k.iloc[-1], 2),
+            'kdj_d': round(d.iloc[-1], 2)
+        },
+        'bollinger': {
+            'upper': round(bb_upper.iloc[-1], 2),
+            'middle': round(bb_ma.iloc[-1], 2),
+            'lower': round(bb_lower.iloc[-1], 2)
+        },
+        'statistics': {
+            'skewness': round(skewness, 4),
+            'kurtosis': round(kurtosis, 4),
+            'daily_volatility': round(returns.std() * 100, 2),
+            'annual_volatility': round(returns.std() * np.sqrt(252) * 100, 2),
+            'avg_daily_return': round(returns.mean() * 100, 4),
+            'cumulative_return': round((closes.iloc[-1] / closes.iloc[0] - 1) * 100, 2)
+        },
+        'signals': signals,
+        'trend': 'bullish' if len([s for s in signals if s['type'] == 'bullish']) > len([s for s in signals if s['type'] == 'bearish']) else 'bearish'
+    }
+
+def warm_symbol(symbol):
+    """预热器刷新任务：拉取价格数据并预计算风险、指标快照与预测"""
+    token = current_route.set('warmer')
+    try:
+        return warm_symbol_results(symbol)
+    finally:
+        current_route.reset(token)
+
+def warm_symbol_results(symbol):
+    stock_data = upstream.history(symbol, period=WARM_PERIOD, priority=WARMUP, refresh=True)
+    if stock_data.empty:
+        raise ValueError(f'无法获取{symbol}的股票数据')
+    
+    market_data = upstream.history(WARM_BENCHMARK, period=WARM_PERIOD, priority=WARMUP, refresh=True)
+    predict_data = upstream.history(symbol, period=WARM_PREDICT_PERIOD, priority=WARMUP, refresh=True)
+    
+    results = {
+        'risk': build_risk_analysis(symbol, WARM_BENCHMARK, stock_data, market_data),
+        'predict': build_predictions(symbol, predict_data, WARM_PREDICT_PERIODS)
+    }
+    if len(stock_data) >= 30:
+        results['quantitative'] = build_quantitative_analysis(symbol, stock_data)
+    
+    return stock_data.index[-1], results
+
+def warmed_risk(symbol, period, benchmark):
+    """默认参数的风险分析请求优先使用预计算结果"""
+    if period == WARM_PERIOD and benchmark == WARM_BENCHMARK:
+        return warmer.get(symbol, 'risk')
+    return None
+
+def warmed_predictions(symbol, periods, method):
+    """默认预测天数的请求优先使用预计算结果，按预测方法裁剪"""
+    if periods == WARM_PREDICT_PERIODS and method in ['arima', 'lstm', 'both']:
+        warmed = warmer.get(symbol, 'predict')
+        if warmed is not None:
+            dropped = {'arima': 'lstm', 'lstm': 'arima'}.get(method)
+            return {k: v for k, v in warmed.items() if k != dropped}
+    return None
+
+def build_stock_data(symbol, data, info):
+    """构建股票数据"""
+    chart_data = []
+    for date, row in data.iterrows():
+        chart_data.append({
+            'date': date.strftime('%Y-%m-%d'),
+            'open': round(row['Open'], 2),
+            'high': round(row['High'], 2),
+            'low': round(row['Low'], 2),
+            'close': round(row['Close'], 2),
+            'volume': int(row['Volume'])
+        })
+    
+    return {
+        'symbol': symbol.upper(),
+        'name': info.get('longName', symbol),
+        'currency': info.get('currency', 'USD'),
+        'exchange': info.get('exchange', 'N/A'),
+        'sector': info.get('sector', 'N/A'),
+        'industry': info.get('industry', 'N/A'),
+        'market_cap': info.get('marketCap', 0),
+        'pe_ratio': info.get('trailingPE', 0),
+        'dividend_yield': info.get('dividendYield', 0),
+        'fifty_two_week_high': info.get('fiftyTwoWeekHigh', 0),
+        'fifty_two_week_low': info.get('fiftyTwoWeekLow', 0),
+        'current_price': round(data['Close'].iloc[-1], 2),
+        'price_change': round(data['Close'].iloc[-1] - data['Close'].iloc[-2], 2),
+        'price_change_percent': round((data['Close'].iloc[-1] - data['Close'].iloc[-2]) / data['Close'].iloc[-2] * 100, 2),
+        'chart_data': chart_data
+    }
+
+def build_compare_entry(symbol, stock_data, market_data, info):
+    """构建对比列表中的单个股票"""
+    with stage('metrics'):
+        risk_metrics = calculate_risk_metrics(stock_data, market_data)
+    
+    return {
+        'symbol': symbol.upper(),
+        'name': info.get('longName', symbol),
+        'current_price': round(stock_data['Close'].iloc[-1], 2),
+        'metrics': risk_metrics
+    }
+
+def build_search_results(query, info):
+    """构建搜索结果"""
+    if 'symbol' in info:
+        return {
+            'results': [{
+                'symbol': info.get('symbol', query),
+                'name': info.get('longName', query),
+                'exchange': info.get('exchange', 'N/A'),
+                'type': info.get('quoteType', 'N/A')
+            }]
+        }
+    return {'results': []}
+
+def resolve_kline_interval(interval, period):
+    """解析K线周期，返回 (周期, 实际数据区间, 实际K线间隔)"""
+    interval_map = {
+        '1h': ('5d', '1h'),
+        '1d': (period, '1d'),
+        '1wk': ('2y', '1wk'),
+        '1mo': ('5y', '1mo')
+    }
+    
+    if interval not in interval_map:
+        interval = '1d'
+    
+    actual_period, actual_interval = interval_map[interval]
+    return interval, actual_period, actual_interval
+
+def build_kline_data(symbol, interval, actual_period, data):
+    """构建多周期K线数据"""
+    candle_data = []
+    for dt, row in data.iterrows():
+        time_format = '%Y-%m-%d %H:%M' if interval == '1h' else '%Y-%m-%d'
+        candle_data.append({
+            'time': dt.strftime(time_format),
+            'open': round(row['Open'], 2),
+            'high': round(row['High'], 2),
+            'low': round(row['Low'], 2),
+            'close': round(row['Close'], 2),
+            'volume': int(row['Volume']),
+            'change': round((row['Close'] - row['Open']) / row['Open'] * 100, 2) if row['Open'] > 0 else 0
         })
+    
+    return {
+        'symbol': symbol.upper(),
+        'interval': interval,
+        'period': actual_period,
+        'data': candle_data,
+        'last_price': round(data['Close'].iloc[-1], 2)
+    }
+
+def build_daily_kline(symbol, period, data):
+    """构建日K线数据"""
+    candle_data = []
+    for dt, row in data.iterrows():
+        candle_data.append({
+            'time': dt.strftime('%Y-%m-%d'),
+            'open': round(row['Open'], 2),
+            'high': round(row['High'], 2),
+            'low': round(row['Low'], 2),
+            'close': round(row['Close'], 2),
+            'volume': int(row['Volume']),
+            'change': round((row['Close'] - row['Open']) / row['Open'] * 100, 2)
+        })
+    
+    return {
+        'symbol': symbol.upper(),
+        'interval': '1d',
+        'period': period,
+        'data': candle_data,
+        'last_price': round(data['Close'].iloc[-1], 2)
+    }
+
+def build_hourly_data(symbol, data):
+    """构建小时级K线数据"""
+    candle_data = []
+    for dt, row in data.iterrows():
+        candle_data.append({
+            'time': dt.strftime('%Y-%m-%d %H:%M'),
+            'open': round(row['Open'], 2),
+            'high': round(row['High'], 2),
+            'low': round(row['Low'], 2),
+            'close': round(row['Close'], 2),
+            'volume': int(row['Volume'])
+        })
+    
+    return {
+        'symbol': symbol.upper(),
+        'interval': '1h',
+        'data': candle_data,
+        'last_price': round(data['Close'].iloc[-1], 2),
+        'last_time': data.index[-1].strftime('%Y-%m-%d %H:%M')
+    }
+
+def build_hourly_predictions(symbol, data):
+    """ARIMA预测未来5小时走势，模型错误时抛出异常"""
+    prices = data['Close'].values
+    
+    model = ARIMA(prices, order=(3, 1, 0))
+    with stage('model_fit'):
+        model_fit = model.fit()
+    MODEL_FITS.inc(model='arima')
+    with stage('forecast'):
+        forecast = model_fit.forecast(steps=5)
+        conf_int = model_fit.get_forecast(steps=5).conf_int()
+    
+    last_time = data.index[-1]
+    prediction_times = []
+    for i in range(1, 6):
+        next_time = last_time + timedelta(hours=i)
+        prediction_times.append(next_time.strftime('%Y-%m-%d %H:%M'))
+    
+    last_close = prices[-1]
+    ai_predictions = []
+    for i, pred in enumerate(forecast):
+        high_est = max(pred, last_close) * 1.005
+        low_est = min(pred, last_close) * 0.995
+        ai_predictions.append({
+            'time': prediction_times[i],
+            'hour': i + 1,
+            'open': round(last_close if i == 0 else forecast[i-1], 2),
+            'close': round(pred, 2),
+            'high': round(high_est, 2),
+            'low': round(low_est, 2),
+            'upper_bound': round(conf_int.iloc[i, 1], 2),
+            'lower_bound': round(conf_int.iloc[i, 0], 2)
+        })
+        last_close = pred
+    
+    return {
+        'symbol': symbol.upper(),
+        'last_price': round(prices[-1], 2),
+        'last_time': data.index[-1].strftime('%Y-%m-%d %H:%M'),
+        'predictions': ai_predictions
+    }
+
+def hourly_prediction_error(e):
+    logger.warning('ARIMA小时预测错误: %s', e)
+    record_error('arima')
+    return {'error': f'预测模型错误: {str(e)}'}, 500
+
+def save_user_prediction_data(symbol, predictions, current_data):
+    """保存用户预测，返回预测ID与数据"""
+    last_time = current_data.index[-1]
+    last_price = current_data['Close'].iloc[-1]
+    
+    user_pred_data = {
+        'symbol': symbol.upper(),
+        'created_at': datetime.now().isoformat(),
+        'base_price': round(last_price, 2),
+        'base_time': last_time.strftime('%Y-%m-%d %H:%M'),
+        'predictions': []
+    }
+    
+    for i, pred in enumerate(predictions):
+        next_time = last_time + timedelta(hours=i+1)
+        user_pred_data['predictions'].append({
+            'time': next_time.strftime('%Y-%m-%d %H:%M'),
+            'hour': i + 1,
+            'open': float(pred.get('open', 0)),
+            'high': float(pred.get('high', 0)),
+            'low': float(pred.get('low', 0)),
+            'close': float(pred.get('close', 0))
+        })
+    
+    key = f"{symbol.upper()}_{datetime.now().strftime('%Y%m%d%H')}"
+    user_predictions[key] = user_pred_data
+    
+    return {
+        'success': True,
+        'prediction_id': key,
+        'data': user_pred_data
+    }
+
+def latest_user_prediction(symbol):
+    """获取某个股票最新的用户预测"""
+    symbol = symbol.upper()
+    user_preds = [v for k, v in user_predictions.items() if k.startswith(symbol)]
+    return sorted(user_preds, key=lambda x: x['created_at'], reverse=True)[0] if user_preds else None
+
+def build_prediction_comparison(symbol, hourly_data, user_pred):
+    """对比用户预测、AI预测和实际走势"""
+    actual_data = []
+    for dt, row in hourly_data.iterrows():
+        actual_data.append({
+            'time': dt.strftime('%Y-%m-%d %H:%M'),
+            'open': round(row['Open'], 2),
+            'high': round(row['High'], 2),
+            'low': round(row['Low'], 2),
+            'close': round(row['Close'], 2)
+        })
+    
+    prices = hourly_data['Close'].values
+    ai_predictions = []
+    try:
+        if len(prices) >= 30:
+            model = ARIMA(prices[:-5] if len(prices) > 5 else prices, order=(3, 1, 0))
+            with stage('model_fit'):
+                model_fit = model.fit()
+            MODEL_FITS.inc(model='arima')
+            with stage('forecast'):
+                forecast = model_fit.forecast(steps=5)
+            
+            start_idx = max(0, len(hourly_data) - 5)
+            for i, pred in enumerate(forecast):
+                if start_idx + i < len(hourly_data):
+                    ai_predictions.append({
+                        'time': hourly_data.index[start_idx + i].strftime('%Y-%m-%d %H:%M'),
+                        'close': round(pred, 2)
+                    })
+    except:
+        pass
+    
+    comparison = {
+        'symbol': symbol,
+        'actual': actual_data[-24:],
+        'ai_prediction': ai_predictions,
+        'user_prediction': user_pred['predictions'] if user_pred else [],
+        'user_base_time': user_pred['base_time'] if user_pred else None,
+        'user_base_price': user_pred['base_price'] if user_pred else None
+    }
+    
+    if user_pred and ai_predictions:
+        user_errors = []
+        ai_errors = []
+        
+        for up in user_pred['predictions']:
+            for actual in actual_data:
+                if actual['time'] == up['time']:
+                    user_errors.append(abs(up['close'] - actual['close']))
+                    break
+        
+        for ap in ai_predictions:
+            for actual in actual_data:
+                if actual['time'] == ap['time']:
+                    ai_errors.append(abs(ap['close'] - actual['close']))
+                    break
+        
+        if user_errors:
+            comparison['user_mae'] = round(sum(user_errors) / len(user_errors), 2)
+        if ai_errors:
+            comparison['ai_mae'] = round(sum(ai_errors) / len(ai_errors), 2)
+    
+    return comparison
+
+def error_payload(e):
+    """统一错误信息，上游数据源故障时返回503而非原始异常"""
+    if isinstance(e, UpstreamError):
+        record_error('upstream')
+        return {'error': '数据源暂时不可用，请稍后重试'}, 503
+    record_error(type(e).__name__)
+    return {'error': str(e)}, 500
+
+def parse_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+upstream = UpstreamScheduler(
+    create_source(
+        os.environ.get('UPSTREAM_SOURCE', 'yahoo'),
+        latency=float(os.environ.get('FAKE_UPSTREAM_LATENCY', 0.05)),
+        failure_rate=float(os.environ.get('FAKE_UPSTREAM_FAILURE_RATE', 0)),
+        throttle_rate=float(os.environ.get('FAKE_UPSTREAM_THROTTLE_RATE', 0))
+    ),
+    rate=float(os.environ.get('UPSTREAM_RATE', 5)),
+    burst=int(os.environ.get('UPSTREAM_BURST', 10)),
+    max_concurrency=int(os.environ.get('UPSTREAM_CONCURRENCY', 8)),
+    price_store=SharedPriceStore(
+        os.environ.get('PRICE_STORE_DIR'),
+        max_bytes=int(os.environ.get('PRICE_STORE_MAX_MB', 64)) * 1024 * 1024,
+        max_idle=int(os.environ.get('PRICE_STORE_MAX_IDLE', 86400))
+    ) if os.environ.get('PRICE_STORE', 'on') != 'off' else None
+)
+
+warmer = AnalyticsWarmer(
+    warm_symbol,
+    watchlist=parse_list(os.environ.get('WARMER_WATCHLIST', '')),
+    calendar=MarketCalendar(
+        holidays=[datetime.strptime(d, '%Y-%m-%d').date() for d in parse_list(os.environ.get('MARKET_HOLIDAYS', ''))],
+        settle_delay=timedelta(minutes=int(os.environ.get('WARMER_SETTLE_MINUTES', 15)))
+    ),
+    workers=int(os.environ.get('WARMER_WORKERS', 4)),
+    interval=int(os.environ.get('WARMER_INTERVAL', 300)),
+    store=WarmStore(os.environ.get('WARMER_DIR'))
+)
+
+# 多worker部署时各进程的指标写入同一目录，任何worker的 /api/metrics 都导出所有进程的合计
+if os.environ.get('METRICS_MULTIPROCESS', 'on') != 'off':
+    registry.enable_multiprocess(os.environ.get('METRICS_DIR') or default_metrics_dir())
+
+# 请求处理器由 app.py 与 asgi.py 共用，执行方式见 handlers.py
+
+def handle_stock_data(symbol, args):
+    period = args.get('period', '1y')
+    data, info = yield [Fetch('history', symbol, period=period), captured(Fetch('info', symbol))]
+    
+    if data.empty:
+        return {'error': '无法获取股票数据，请检查股票代码'}, 404
+    if isinstance(info, Exception):
+        raise info
+    
+    return (yield Compute(build_stock_data, symbol, data, info))
+
+def handle_risk_analysis(symbol, args):
+    period = args.get('period', '1y')
+    benchmark = args.get('benchmark', 'SPY')
+    
+    warmed = warmed_risk(symbol, period, benchmark)
+    if warmed is not None:
+        return warmed
+    
+    stock_data, market_data = yield [Fetch('history', symbol, period=period), Fetch('history', benchmark, period=period)]
+    
+    if stock_data.empty:
+        return {'error': '无法获取股票数据'}, 404
+    
+    return (yield Compute(build_risk_analysis, symbol, benchmark, stock_data, market_data))
+
+def handle_predictions(symbol, args):
+    periods = int(args.get('periods', 30))
+    method = args.get('method', 'both')
+    
+    warmed = warmed_predictions(symbol, periods, method)
+    if warmed is not None:
+        return warmed
+    
+    data = yield Fetch('history', symbol, period=WARM_PREDICT_PERIOD)
+    
+    if data.empty:
+        return {'error': '无法获取股票数据'}, 404
+    
+    return (yield Compute(build_predictions, symbol, data, periods, method))
+
+def fetch_compare_entry(symbol, period):
+    stock_data, info = yield [Fetch('history', symbol, period=period), Fetch('info', symbol)]
+    return None if stock_data.empty else (symbol, stock_data, info)
+
+def handle_compare(data):
+    """基准与各股票的数据一起获取，单只股票失败时跳过"""
+    symbols = data.get('symbols', [])[:10]
+    period = data.get('period', '1y')
+    benchmark = data.get('benchmark', 'SPY')
+    
+    market_data, *fetched = yield [Fetch('history', benchmark, period=period)] + \
+        [guarded(fetch_compare_entry(symbol, period)) for symbol in symbols]
+    
+    entries = yield [guarded(Compute(build_compare_entry, symbol, stock_data, market_data, info))
+                     for symbol, stock_data, info in filter(None, fetched)]
+    
+    return {'comparison': [entry for entry in entries if entry], 'benchmark': benchmark}
+
+def handle_search(query):
+    try:
+        return build_search_results(query, (yield Fetch('info', query)))
+    except Exception:
+        return {'results': []}
+
+def handle_health():
+    return {'status': 'ok', 'timestamp': datetime.now().isoformat()}
+
+def handle_price_store_footprint():
+    if upstream.price_store is None:
+        return {'error': '共享价格存储未启用'}, 404
+    return upstream.price_store.footprint()
+
+def handle_kline(symbol, args):
+    interval, actual_period, actual_interval = resolve_kline_interval(
+        args.get('interval', '1d'),
+        args.get('period', '3mo')
+    )
+    data = yield Fetch('history', symbol, period=actual_period, interval=actual_interval)
+    
+    if data.empty:
+        return {'error': '无法获取K线数据'}, 404
+    
+    return (yield Compute(build_kline_data, symbol, interval, actual_period, data))
+
+def handle_quantitative_analysis(symbol):
+    warmed = warmer.get(symbol, 'quantitative')
+    if warmed is not None:
+        return warmed
+    
+    data = yield Fetch('history', symbol, period=WARM_PERIOD)
+    
+    if data.empty or len(data) < 30:
+        return {'error': '数据不足'}, 404
+    
+    return (yield Compute(build_quantitative_analysis, symbol, data))
+
+def handle_daily_kline(symbol, args):
+    period = args.get('period', '3mo')
+    data = yield Fetch('history', symbol, period=period, interval='1d')
+    
+    if data.empty:
+        return {'error': '无法获取日K线数据'}, 404
+    
+    return (yield Compute(build_daily_kline, symbol, period, data))
+
+def handle_hourly_data(symbol):
+    data = yield Fetch('history', symbol, period='5d', interval='1h')
+    
+    if data.empty:
+        return {'error': '无法获取小时数据'}, 404
+    
+    return (yield Compute(build_hourly_data, symbol, data))
+
+def handle_hourly_predictions(symbol):
+    data = yield Fetch('history', symbol, period='1mo', interval='1h')
+    
+    if data.empty or len(data) < 30:
+        return {'error': '数据不足，无法预测'}, 404
+    
+    try:
+        return (yield Compute(build_hourly_predictions, symbol, data))
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return hourly_prediction_error(e)
+
+def handle_save_user_prediction(symbol, data):
+    predictions = data.get('predictions', [])
+    
+    if len(predictions) != 5:
+        return {'error': '需要5个小时的预测数据'}, 400
+    
+    current_data = yield Fetch('history', symbol, period='1d', interval='1h')
+    
+    if current_data.empty:
+        return {'error': '无法获取当前价格'}, 404
+    
+    return save_user_prediction_data(symbol, predictions, current_data)
+
+def handle_user_prediction(symbol):
+    latest = latest_user_prediction(symbol)
+    return latest if latest else {'predictions': []}
+
+def handle_prediction_comparison(symbol):
+    symbol = symbol.upper()
+    user_pred = latest_user_prediction(symbol)
+    
+    hourly_data = yield Fetch('history', symbol, period='5d', interval='1h')
+    
+    if hourly_data.empty:
+        return {'error': '无法获取数据'}, 404
+    
+    return (yield Compute(build_prediction_comparison, symbol, hourly_data, user_pred))
+
+def run_handler(handle, *args):
+    """同步执行请求处理器，异常统一转换为错误响应"""
+    try:
+        return run_sync(handle(*args), upstream)
+    except Exception as e:
+        return error_payload(e)
+
+@app.route('/api/stock/<symbol>', methods=['GET'])
+def get_stock_data(symbol):
+    """获取股票数据"""
+    return run_handler(handle_stock_data, symbol, request.args)
+
+@app.route('/api/risk/<symbol>', methods=['GET'])
+def get_risk_analysis(symbol):
+    """获取风险分析"""
+    return run_handler(handle_risk_analysis, symbol, request.args)
 
 @app.route('/api/predict/<symbol>', methods=['GET'])
 def get_predictions(symbol):
     """获取预测数据"""
-    try:
-        periods = int(request.args.get('periods', 30))
-        method = request.args.get('method', 'both')
-        
-        stock = yf.Ticker(symbol)
-        data = stock.history(period='2y')
-        
-        if data.empty:
-            return jsonify({'error': '无法获取股票数据'}), 404
-        
-        result = {
-            'symbol': symbol.upper(),
-            'last_price': round(data['Close'].iloc[-1], 2),
-            'last_date': data.index[-1].strftime('%Y-%m-%d'),
-            'prediction_dates': [(data.index[-1] + timedelta(days=i+1)).strftime('%Y-%m-%d') for i in range(periods)]
-        }
-        
-        if method in ['arima', 'both']:
-            arima_result = arima_predict(data, periods)
-            if arima_result:
-                result['arima'] = arima_result
-        
-        if method in ['lstm', 'both']:
-            lstm_result = lstm_predict(data, periods)
-            if lstm_result:
-                result['lstm'] = lstm_result
-        
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_predictions, symbol, request.args)
 
 @app.route('/api/compare', methods=['POST'])
 def compare_stocks():
     """比较多个股票"""
-    try:
-        data = request.json
-        symbols = data.get('symbols', [])
-        period = data.get('period', '1y')
-        benchmark = data.get('benchmark', 'SPY')
-        
-        market = yf.Ticker(benchmark)
-        market_data = market.history(period=period)
-        
-        results = []
-        for symbol in symbols[:10]:
-            try:
-                stock = yf.Ticker(symbol)
-                stock_data = stock.history(period=period)
-                
-                if not stock_data.empty:
-                    risk_metrics = calculate_risk_metrics(stock_data, market_data)
-                    info = stock.info
-                    
-                    results.append({
-                        'symbol': symbol.upper(),
-                        'name': info.get('longName', symbol),
-                        'current_price': round(stock_data['Close'].iloc[-1], 2),
-                        'metrics': risk_metrics
-                    })
-            except:
-                continue
-        
-        return jsonify({'comparison': results, 'benchmark': benchmark})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_compare, request.get_json(silent=True) or {})
 
 @app.route('/api/search/<query>', methods=['GET'])
 def search_stocks(query):
     """搜索股票"""
-    try:
-        ticker = yf.Ticker(query)
-        info = ticker.info
-        
-        if 'symbol' in info:
-            return jsonify({
-                'results': [{
-                    'symbol': info.get('symbol', query),
-                    'name': info.get('longName', query),
-                    'exchange': info.get('exchange', 'N/A'),
-                    'type': info.get('quoteType', 'N/A')
-                }]
-            })
-        return jsonify({'results': []})
-    except:
-        return jsonify({'results': []})
+    return run_handler(handle_search, query)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查"""
-    return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
+    return run_handler(handle_health)
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/warmer/status', methods=['GET'])
+def warmer_status():
+    """预热器新鲜度与滞后报告"""
+    return run_handler(warmer.report)
+
+@app.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats():
+    """上游调度器排队、限流与缓存指标"""
+    return run_handler(upstream.stats)
+
+@app.route('/api/price-store/footprint', methods=['GET'])
+def price_store_footprint():
+    """共享价格数组每个股票的内存占用"""
+    return run_handler(handle_price_store_footprint)
 
 @app.route('/api/kline/<symbol>', methods=['GET'])
 def get_kline_data(symbol):
     """获取多周期K线数据"""
-    try:
-        interval = request.args.get('interval', '1d')
-        period = request.args.get('period', '3mo')
-        
-        interval_map = {
-            '1h': ('5d', '1h'),
-            '1d': (period, '1d'),
-            '1wk': ('2y', '1wk'),
-            '1mo': ('5y', '1mo')
-        }
-        
-        if interval not in interval_map:
-            interval = '1d'
-        
-        actual_period, actual_interval = interval_map[interval]
-        if interval == '1d':
-            actual_period = period
-        
-        stock = yf.Ticker(symbol)
-        data = stock.history(period=actual_period, interval=actual_interval)
-        
-        if data.empty:
-            return jsonify({'error': '无法获取K线数据'}), 404
-        
-        candle_data = []
-        for dt, row in data.iterrows():
-            time_format = '%Y-%m-%d %H:%M' if interval == '1h' else '%Y-%m-%d'
-            candle_data.append({
-                'time': dt.strftime(time_format),
-                'open': round(row['Open'], 2),
-                'high': round(row['High'], 2),
-                'low': round(row['Low'], 2),
-                'close': round(row['Close'], 2),
-                'volume': int(row['Volume']),
-                'change': round((row['Close'] - row['Open']) / row['Open'] * 100, 2) if row['Open'] > 0 else 0
-            })
-        
-        return jsonify({
-            'symbol': symbol.upper(),
-            'interval': interval,
-            'period': actual_period,
-            'data': candle_data,
-            'last_price': round(data['Close'].iloc[-1], 2)
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_kline, symbol, request.args)
 
 @app.route('/api/quantitative/<symbol>', methods=['GET'])
 def get_quantitative_analysis(symbol):
     """获取量化细致分析"""
-    try:
-        stock = yf.Ticker(symbol)
-        data = stock.history(period='1y')
-        
-        if data.empty or len(data) < 30:
-            return jsonify({'error': '数据不足'}), 404
-        
-        closes = data['Close']
-        returns = closes.pct_change().dropna()
-        
-        ma5 = closes.rolling(5).mean().iloc[-1]
-        ma10 = closes.rolling(10).mean().iloc[-1]
-        ma20 = closes.rolling(20).mean().iloc[-1]
-        ma60 = closes.rolling(60).mean().iloc[-1] if len(closes) >= 60 else None
-        
-        delta = closes.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs)).iloc[-1]
-        
-        ema12 = closes.ewm(span=12).mean()
-        ema26 = closes.ewm(span=26).mean()
-        macd = ema12 - ema26
-        signal = macd.ewm(span=9).mean()
-        macd_hist = macd - signal
-        
-        bb_ma = closes.rolling(20).mean()
-        bb_std = closes.rolling(20).std()
-        bb_upper = bb_ma + 2 * bb_std
-        bb_lower = bb_ma - 2 * bb_std
-        
-        lowest_14 = closes.rolling(14).min()
-        highest_14 = closes.rolling(14).max()
-        k = 100 * (closes - lowest_14) / (highest_14 - lowest_14)
-        d = k.rolling(3).mean()
-        
-        skewness = returns.skew()
-        kurtosis = returns.kurtosis()
-        
-        current_price = closes.iloc[-1]
-        
-        signals = []
-        if current_price > ma5.item() if hasattr(ma5, 'item') else ma5:
-            signals.append({'type': 'bullish', 'indicator': 'MA5', 'desc': '价格在5日均线上方'})
-        else:
-            signals.append({'type': 'bearish', 'indicator': 'MA5', 'desc': '价格在5日均线下方'})
-        
-        rsi_val = rsi.item() if hasattr(rsi, 'item') else rsi
-        if rsi_val > 70:
-            signals.append({'type': 'bearish', 'indicator': 'RSI', 'desc': f'RSI={rsi_val:.1f} 超买区域'})
-        elif rsi_val < 30:
-            signals.append({'type': 'bullish', 'indicator': 'RSI', 'desc': f'RSI={rsi_val:.1f} 超卖区域'})
-        else:
-            signals.append({'type': 'neutral', 'indicator': 'RSI', 'desc': f'RSI={rsi_val:.1f} 中性区域'})
-        
-        macd_val = macd.iloc[-1]
-        signal_val = signal.iloc[-1]
-        if macd_val > signal_val:
-            signals.append({'type': 'bullish', 'indicator': 'MACD', 'desc': 'MACD金叉，看多信号'})
-        else:
-            signals.append({'type': 'bearish', 'indicator': 'MACD', 'desc': 'MACD死叉，看空信号'})
-        
-        return jsonify({
-            'symbol': symbol.upper(),
-            'current_price': round(current_price, 2),
-            'moving_averages': {
-                'ma5': round(ma5, 2),
-                'ma10': round(ma10, 2),
-                'ma20': round(ma20, 2),
-                'ma60': round(ma60, 2) if ma60 else None
-            },
-            'indicators': {
-                'rsi': round(rsi_val, 2),
-                'macd': round(macd.iloc[-1], 4),
-                'macd_signal': round(signal.iloc[-1], 4),
-                'macd_hist': round(macd_hist.iloc[-1], 4),
-                'kdj_k': round(k.iloc[-1], 2),
-                'kdj_d': round(d.iloc[-1], 2)
-            },
-            'bollinger': {
-                'upper': round(bb_upper.iloc[-1], 2),
-                'middle': round(bb_ma.iloc[-1], 2),
-                'lower': round(bb_lower.iloc[-1], 2)
-            },
-            'statistics': {
-                'skewness': round(skewness, 4),
-                'kurtosis': round(kurtosis, 4),
-                'daily_volatility': round(returns.std() * 100, 2),
-                'annual_volatility': round(returns.std() * np.sqrt(252) * 100, 2),
-                'avg_daily_return': round(returns.mean() * 100, 4),
-                'cumulative_return': round((closes.iloc[-1] / closes.iloc[0] - 1) * 100, 2)
-            },
-            'signals': signals,
-            'trend': 'bullish' if len([s for s in signals if s['type'] == 'bullish']) > len([s for s in signals if s['type'] == 'bearish']) else 'bearish'
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_quantitative_analysis, symbol)
 
 @app.route('/api/daily-kline/<symbol>', methods=['GET'])
 def get_daily_kline(symbol):
     """获取日K线数据"""
-    try:
-        period = request.args.get('period', '3mo')
-        stock = yf.Ticker(symbol)
-        data = stock.history(period=period, interval='1d')
-        
-        if data.empty:
-            return jsonify({'error': '无法获取日K线数据'}), 404
-        
-        candle_data = []
-        for dt, row in data.iterrows():
-            candle_data.append({
-                'time': dt.strftime('%Y-%m-%d'),
-                'open': round(row['Open'], 2),
-                'high': round(row['High'], 2),
-                'low': round(row['Low'], 2),
-                'close': round(row['Close'], 2),
-                'volume': int(row['Volume']),
-                'change': round((row['Close'] - row['Open']) / row['Open'] * 100, 2)
-            })
-        
-        return jsonify({
-            'symbol': symbol.upper(),
-            'interval': '1d',
-            'period': period,
-            'data': candle_data,
-            'last_price': round(data['Close'].iloc[-1], 2)
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_daily_kline, symbol, request.args)
 
 @app.route('/api/hourly/<symbol>', methods=['GET'])
 def get_hourly_data(symbol):
     """获取小时级K线数据"""
-    try:
-        stock = yf.Ticker(symbol)
-        data = stock.history(period='5d', interval='1h')
-        
-        if data.empty:
-            return jsonify({'error': '无法获取小时数据'}), 404
-        
-        candle_data = []
-        for dt, row in data.iterrows():
-            candle_data.append({
-                'time': dt.strftime('%Y-%m-%d %H:%M'),
-                'open': round(row['Open'], 2),
-                'high': round(row['High'], 2),
-                'low': round(row['Low'], 2),
-                'close': round(row['Close'], 2),
-                'volume': int(row['Volume'])
-            })
-        
-        return jsonify({
-            'symbol': symbol.upper(),
-            'interval': '1h',
-            'data': candle_data,
-            'last_price': round(data['Close'].iloc[-1], 2),
-            'last_time': data.index[-1].strftime('%Y-%m-%d %H:%M')
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_hourly_data, symbol)
 
 @app.route('/api/hourly-predict/<symbol>', methods=['GET'])
 def get_hourly_predictions(symbol):
     """获取未来5小时AI预测"""
-    try:
-        stock = yf.Ticker(symbol)
-        data = stock.history(period='1mo', interval='1h')
-        
-        if data.empty or len(data) < 30:
-            return jsonify({'error': '数据不足，无法预测'}), 404
-        
-        prices = data['Close'].values
-        
-        try:
-            model = ARIMA(prices, order=(3, 1, 0))
-            model_fit = model.fit()
-            forecast = model_fit.forecast(steps=5)
-            conf_int = model_fit.get_forecast(steps=5).conf_int()
-            
-            last_time = data.index[-1]
-            prediction_times = []
-            for i in range(1, 6):
-                next_time = last_time + timedelta(hours=i)
-                prediction_times.append(next_time.strftime('%Y-%m-%d %H:%M'))
-            
-            last_close = prices[-1]
-            ai_predictions = []
-            for i, pred in enumerate(forecast):
-                high_est = max(pred, last_close) * 1.005
-                low_est = min(pred, last_close) * 0.995
-                ai_predictions.append({
-                    'time': prediction_times[i],
-                    'hour': i + 1,
-                    'open': round(last_close if i == 0 else forecast[i-1], 2),
-                    'close': round(pred, 2),
-                    'high': round(high_est, 2),
-                    'low': round(low_est, 2),
-                    'upper_bound': round(conf_int.iloc[i, 1], 2),
-                    'lower_bound': round(conf_int.iloc[i, 0], 2)
-                })
-                last_close = pred
-            
-            return jsonify({
-                'symbol': symbol.upper(),
-                'last_price': round(prices[-1], 2),
-                'last_time': data.index[-1].strftime('%Y-%m-%d %H:%M'),
-                'predictions': ai_predictions
-            })
-        except Exception as e:
-            print(f"ARIMA小时预测错误: {e}")
-            return jsonify({'error': f'预测模型错误: {str(e)}'}), 500
-            
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_hourly_predictions, symbol)
 
 @app.route('/api/user-predict/<symbol>', methods=['POST'])
 def save_user_prediction(symbol):
     """保存用户预测"""
-    try:
-        data = request.json
-        predictions = data.get('predictions', [])
-        
-        if len(predictions) != 5:
-            return jsonify({'error': '需要5个小时的预测数据'}), 400
-        
-        stock = yf.Ticker(symbol)
-        current_data = stock.history(period='1d', interval='1h')
-        
-        if current_data.empty:
-            return jsonify({'error': '无法获取当前价格'}), 404
-        
-        last_time = current_data.index[-1]
-        last_price = current_data['Close'].iloc[-1]
-        
-        user_pred_data = {
-            'symbol': symbol.upper(),
-            'created_at': datetime.now().isoformat(),
-            'base_price': round(last_price, 2),
-            'base_time': last_time.strftime('%Y-%m-%d %H:%M'),
-            'predictions': []
-        }
-        
-        for i, pred in enumerate(predictions):
-            next_time = last_time + timedelta(hours=i+1)
-            user_pred_data['predictions'].append({
-                'time': next_time.strftime('%Y-%m-%d %H:%M'),
-                'hour': i + 1,
-                'open': float(pred.get('open', 0)),
-                'high': float(pred.get('high', 0)),
-                'low': float(pred.get('low', 0)),
-                'close': float(pred.get('close', 0))
-            })
-        
-        key = f"{symbol.upper()}_{datetime.now().strftime('%Y%m%d%H')}"
-        user_predictions[key] = user_pred_data
-        
-        return jsonify({
-            'success': True,
-            'prediction_id': key,
-            'data': user_pred_data
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_save_user_prediction, symbol, request.get_json(silent=True) or {})
 
 @app.route('/api/user-predict/<symbol>', methods=['GET'])
 def get_user_prediction(symbol):
     """获取用户预测"""
-    try:
-        symbol = symbol.upper()
-        user_preds = [v for k, v in user_predictions.items() if k.startswith(symbol)]
-        
-        if not user_preds:
-            return jsonify({'predictions': []})
-        
-        latest = sorted(user_preds, key=lambda x: x['created_at'], reverse=True)[0]
-        return jsonify(latest)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_user_prediction, symbol)
 
 @app.route('/api/compare-predictions/<symbol>', methods=['GET'])
 def compare_predictions(symbol):
     """对比用户预测、AI预测和实际走势"""
-    try:
-        symbol = symbol.upper()
-        
-        user_preds = [v for k, v in user_predictions.items() if k.startswith(symbol)]
-        user_pred = sorted(user_preds, key=lambda x: x['created_at'], reverse=True)[0] if user_preds else None
-        
-        stock = yf.Ticker(symbol)
-        hourly_data = stock.history(period='5d', interval='1h')
-        
-        if hourly_data.empty:
-            return jsonify({'error': '无法获取数据'}), 404
-        
-        actual_data = []
-        for dt, row in hourly_data.iterrows():
-            actual_data.append({
-                'time': dt.strftime('%Y-%m-%d %H:%M'),
-                'open': round(row['Open'], 2),
-                'high': round(row['High'], 2),
-                'low': round(row['Low'], 2),
-                'close': round(row['Close'], 2)
-            })
-        
-        prices = hourly_data['Close'].values
-        ai_predictions = []
-        try:
-            if len(prices) >= 30:
-                model = ARIMA(prices[:-5] if len(prices) > 5 else prices, order=(3, 1, 0))
-                model_fit = model.fit()
-                forecast = model_fit.forecast(steps=5)
-                
-                start_idx = max(0, len(hourly_data) - 5)
-                for i, pred in enumerate(forecast):
-                    if start_idx + i < len(hourly_data):
-                        ai_predictions.append({
-                            'time': hourly_data.index[start_idx + i].strftime('%Y-%m-%d %H:%M'),
-                            'close': round(pred, 2)
-                        })
-        except:
-            pass
-        
-        comparison = {
-            'symbol': symbol,
-            'actual': actual_data[-24:],
-            'ai_prediction': ai_predictions,
-            'user_prediction': user_pred['predictions'] if user_pred else [],
-            'user_base_time': user_pred['base_time'] if user_pred else None,
-            'user_base_price': user_pred['base_price'] if user_pred else None
-        }
-        
-        if user_pred and ai_predictions:
-            user_errors = []
-            ai_errors = []
-            
-            for up in user_pred['predictions']:
-                for actual in actual_data:
-                    if actual['time'] == up['time']:
-                        user_errors.append(abs(up['close'] - actual['close']))
-                        break
-            
-            for ap in ai_predictions:
-                for actual in actual_data:
-                    if actual['time'] == ap['time']:
-                        ai_errors.append(abs(ap['close'] - actual['close']))
-                        break
-            
-            if user_errors:
-                comparison['user_mae'] = round(sum(user_errors) / len(user_errors), 2)
-            if ai_errors:
-                comparison['ai_mae'] = round(sum(ai_errors) / len(ai_errors), 2)
-        
-        return jsonify(comparison)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return run_handler(handle_prediction_comparison, symbol)
+
+def collect_component_metrics():
+    """导出上游调度器、预热器与共享价格存储的指标"""
+    stats = upstream.stats()
+    cache_requests = Counter('finrisk_cache_requests_total', '缓存查询次数', ['cache', 'result'])
+    cache_hit_ratio = Gauge('finrisk_cache_hit_ratio', '缓存命中率', ['cache'], multiprocess_mode='all')
+    for result, key in [('hit', 'cache_hits'), ('miss', 'cache_misses'), ('stale', 'stale_served')]:
+        cache_requests.inc(stats[key], cache='upstream', result=result)
+    cache_requests.inc(warmer.served, cache='warmer', result='hit')
+    cache_requests.inc(warmer.missed, cache='warmer', result='miss')
+    upstream_total = stats['cache_hits'] + stats['cache_misses'] + stats['stale_served']
+    warmer_total = warmer.served + warmer.missed
+    cache_hit_ratio.set((stats['cache_hits'] + stats['stale_served']) / upstream_total if upstream_total else 0, cache='upstream')
+    cache_hit_ratio.set(warmer.served / warmer_total if warmer_total else 0, cache='warmer')
+    
+    upstream_requests = Counter('finrisk_upstream_requests_total', '上游请求数', ['lane'])
+    queue_wait = Counter('finrisk_upstream_queue_wait_seconds_total', '上游请求累计排队时间', ['lane'])
+    queue_wait_max = Gauge('finrisk_upstream_queue_wait_max_seconds', '上游请求最长排队时间', ['lane'],
+                           multiprocess_mode='max')
+    for lane, lane_stats in stats['lanes'].items():
+        upstream_requests.inc(lane_stats['requests'], lane=lane)
+        queue_wait.inc(lane_stats['queue_wait_sum'], lane=lane)
+        queue_wait_max.set(lane_stats['queue_wait_max'], lane=lane)
+    
+    events = Counter('finrisk_upstream_events_total', '上游限流、重试与失败事件', ['event'])
+    for event in ['throttle_events', 'retries', 'failures', 'revalidations', 'queue_timeouts']:
+        events.inc(stats[event], event=event)
+    
+    upstream_in_flight = Gauge('finrisk_upstream_in_flight', '处理中的上游请求数')
+    upstream_in_flight.set(stats['in_flight'])
+    upstream_waiting = Gauge('finrisk_upstream_waiting', '排队中的上游请求数')
+    upstream_waiting.set(stats['waiting'])
+    
+    # 预计算结果与价格数组在所有worker间共享，各进程导出的值相同，合并时取最大值
+    warmer_lag = Gauge('finrisk_warmer_lag_seconds', '预计算结果的滞后时间', ['symbol'], multiprocess_mode='max')
+    for item in warmer.report()['symbols']:
+        if item['lag_seconds'] is not None:
+            warmer_lag.set(item['lag_seconds'], symbol=item['symbol'])
+    
+    metrics = [cache_requests, cache_hit_ratio, upstream_requests, queue_wait, queue_wait_max,
+               events, upstream_in_flight, upstream_waiting, warmer_lag]
+    if upstream.price_store is not None:
+        store_bytes = Gauge('finrisk_price_store_bytes', '共享价格数组占用字节数', ['symbol'], multiprocess_mode='max')
+        for symbol, footprint in upstream.price_store.footprint()['symbols'].items():
+            store_bytes.set(footprint['bytes'], symbol=symbol)
+        metrics.append(store_bytes)
+    return metrics
+
+registry.add_collector(collect_component_metrics)
+
+profiler = None
+if os.environ.get('PROFILE_SLOW_MS'):
+    profiler = SamplingProfiler(
+        threshold=float(os.environ['PROFILE_SLOW_MS']) / 1000,
+        output_dir=os.environ.get('PROFILE_DIR', 'profiles'),
+        interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+    )
+    profiler.start()
+
+# 请求级指标与采样分析由 app.py 与 asgi.py 的请求钩子共用
+
+def begin_request(rule, track_thread=True):
+    """记录请求开始，返回用于恢复路由标签的token"""
+    token = current_route.set(rule)
+    IN_FLIGHT.inc()
+    if profiler:
+        profiler.begin(track_thread)
+    return token
+
+def record_request(method, path, status, duration):
+    route = current_route.get()
+    REQUEST_DURATION.observe(duration, route=route)
+    REQUESTS.inc(route=route, method=method, status=status)
+    if profiler:
+        profile_path = profiler.end(duration, f'{method} {path}')
+        if profile_path:
+            logger.warning('慢请求 %s 耗时%.2fs，采样栈已保存到 %s', path, duration, profile_path)
+
+def finish_request(token):
+    IN_FLIGHT.dec()
+    current_route.reset(token)
+    registry.maybe_flush()
+
+@app.before_request
+def start_request_metrics():
+    g.route_token = begin_request(request.url_rule.rule if request.url_rule else 'unmatched')
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    record_request(request.method, request.path, response.status_code, time.perf_counter() - g.request_started)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'route_token' in g:
+        finish_request(g.pop('route_token'))
+
+# 调试模式下重载器的父进程不处理请求，只在实际服务的进程中启动预热器；
+# 多个worker中只有持有锁文件的一个实际执行预热，结果通过 WARMER_DIR 共享
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    warmer.start()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
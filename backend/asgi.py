@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, Response, g, request
+from quart_cors import cors
+
+import app as core
+from handlers import run_async
+from metrics import registry, TimedJSONProvider
+
+app = Quart(__name__)
+app.json = TimedJSONProvider(app)
+app = cors(app, allow_origin='*')
+
+# 指标计算与模型训练在线程池中执行，事件循环只负责调度I/O
+cpu_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASGI_CPU_WORKERS', os.cpu_count() or 4)),
+    thread_name_prefix='cpu'
+)
+
+
+def profiled(func, *args):
+    with core.profiler.attach():
+        return func(*args)
+
+
+async def run_cpu(func, *args):
+    """在CPU线程池中执行同步计算，开启采样分析时计算线程的调用栈计入当前请求"""
+    context = contextvars.copy_context()
+    if core.profiler:
+        func, args = profiled, (func, *args)
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, context.run, func, *args)
+
+
+async def run_handler(handle, *args):
+    """异步执行 app.py 中的请求处理器，异常统一转换为错误响应"""
+    try:
+        return await run_async(handle(*args), core.upstream, run_cpu)
+    except Exception as e:
+        return core.error_payload(e)
+
+
+@app.before_request
+async def start_request_metrics():
+    g.route_token = core.begin_request(request.url_rule.rule if request.url_rule else 'unmatched', track_thread=False)
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request_metrics(response):
+    core.record_request(request.method, request.path, response.status_code, time.perf_counter() - g.request_started)
+    return response
+
+
+@app.teardown_request
+async def finish_request_metrics(exc):
+    if 'route_token' in g:
+        core.finish_request(g.pop('route_token'))
+
+
+@app.route('/api/stock/<symbol>', methods=['GET'])
+async def get_stock_data(symbol):
+    """获取股票数据"""
+    return await run_handler(core.handle_stock_data, symbol, request.args)
+
+
+@app.route('/api/risk/<symbol>', methods=['GET'])
+async def get_risk_analysis(symbol):
+    """获取风险分析，股票与基准并发获取"""
+    return await run_handler(core.handle_risk_analysis, symbol, request.args)
+
+
+@app.route('/api/predict/<symbol>', methods=['GET'])
+async def get_predictions(symbol):
+    """获取预测数据"""
+    return await run_handler(core.handle_predictions, symbol, request.args)
+
+
+@app.route('/api/compare', methods=['POST'])
+async def compare_stocks():
+    """比较多个股票，基准与各股票的数据并发获取"""
+    return await run_handler(core.handle_compare, await request.get_json(silent=True) or {})
+
+
+@app.route('/api/search/<query>', methods=['GET'])
+async def search_stocks(query):
+    """搜索股票"""
+    return await run_handler(core.handle_search, query)
+
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """健康检查"""
+    return await run_handler(core.handle_health)
+
+
+@app.route('/api/metrics', methods=['GET'])
+async def prometheus_metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(registry.render(), content_type=core.METRICS_CONTENT_TYPE)
+
+
+@app.route('/api/warmer/status', methods=['GET'])
+async def warmer_status():
+    """预热器新鲜度与滞后报告"""
+    return await run_handler(core.warmer.report)
+
+
+@app.route('/api/upstream/stats', methods=['GET'])
+async def upstream_stats():
+    """上游调度器排队、限流与缓存指标"""
+    return await run_handler(core.upstream.stats)
+
+
+@app.route('/api/price-store/footprint', methods=['GET'])
+async def price_store_footprint():
+    """共享价格数组每个股票的内存占用"""
+    return await run_handler(core.handle_price_store_footprint)
+
+
+@app.route('/api/kline/<symbol>', methods=['GET'])
+async def get_kline_data(symbol):
+    """获取多周期K线数据"""
+    return await run_handler(core.handle_kline, symbol, request.args)
+
+
+@app.route('/api/quantitative/<symbol>', methods=['GET'])
+async def get_quantitative_analysis(symbol):
+    """获取量化细致分析"""
+    return await run_handler(core.handle_quantitative_analysis, symbol)
+
+
+@app.route('/api/daily-kline/<symbol>', methods=['GET'])
+async def get_daily_kline(symbol):
+    """获取日K线数据"""
+    return await run_handler(core.handle_daily_kline, symbol, request.args)
+
+
+@app.route('/api/hourly/<symbol>', methods=['GET'])
+async def get_hourly_data(symbol):
+    """获取小时级K线数据"""
+    return await run_handler(core.handle_hourly_data, symbol)
+
+
+@app.route('/api/hourly-predict/<symbol>', methods=['GET'])
+async def get_hourly_predictions(symbol):
+    """获取未来5小时AI预测"""
+    return await run_handler(core.handle_hourly_predictions, symbol)
+
+
+@app.route('/api/user-predict/<symbol>', methods=['POST'])
+async def save_user_prediction(symbol):
+    """保存用户预测"""
+    return await run_handler(core.handle_save_user_prediction, symbol, await request.get_json(silent=True) or {})
+
+
+@app.route('/api/user-predict/<symbol>', methods=['GET'])
+async def get_user_prediction(symbol):
+    """获取用户预测"""
+    return await run_handler(core.handle_user_prediction, symbol)
+
+
+@app.route('/api/compare-predictions/<symbol>', methods=['GET'])
+async def compare_predictions(symbol):
+    """对比用户预测、AI预测和实际走势"""
+    return await run_handler(core.handle_prediction_comparison, symbol)
+
+
+if __name__ == '__main__':
+    app.run(debug=True, port=5001)
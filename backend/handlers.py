@@ -0,0 +1,90 @@
+import asyncio
+import inspect
+
+# 请求处理器是生成器：yield 一个 Fetch/Compute 或子处理器并接收结果，yield 列表时其中的步骤
+# 可以并发执行，最后 return 响应数据。同步与异步模式共用同一套处理器，只是执行方式不同
+
+
+class Fetch:
+    """一次上游请求，method 为调度器的 history 或 info"""
+
+    def __init__(self, method, *args, **kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Compute:
+    """一次CPU计算，异步模式下在计算线程池中执行"""
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+
+def guarded(step):
+    """执行失败时返回None，用于对比分析中单只股票的失败不影响其他股票"""
+    try:
+        return (yield step)
+    except Exception:
+        return None
+
+
+def captured(step):
+    """执行失败时返回异常对象，由处理器决定何时抛出"""
+    try:
+        return (yield step)
+    except Exception as e:
+        return e
+
+
+def run_sync(handler, upstream):
+    """同步执行：上游请求依次获取，计算在当前线程执行"""
+    if not inspect.isgenerator(handler):
+        return handler
+    value, error = None, None
+    while True:
+        try:
+            step = handler.throw(error) if error is not None else handler.send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = run_step(step, upstream), None
+        except Exception as e:
+            value, error = None, e
+
+
+def run_step(step, upstream):
+    if isinstance(step, list):
+        return [run_step(s, upstream) for s in step]
+    if isinstance(step, Fetch):
+        return getattr(upstream, step.method)(*step.args, **step.kwargs)
+    if isinstance(step, Compute):
+        return step.func(*step.args)
+    return run_sync(step, upstream)
+
+
+async def run_async(handler, upstream, run_cpu):
+    """异步执行：同一列表中的上游请求与计算并发执行，计算交给 run_cpu"""
+    if not inspect.isgenerator(handler):
+        return handler
+    value, error = None, None
+    while True:
+        try:
+            step = handler.throw(error) if error is not None else handler.send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = await run_step_async(step, upstream, run_cpu), None
+        except Exception as e:
+            value, error = None, e
+
+
+async def run_step_async(step, upstream, run_cpu):
+    if isinstance(step, list):
+        return list(await asyncio.gather(*[run_step_async(s, upstream, run_cpu) for s in step]))
+    if isinstance(step, Fetch):
+        return await getattr(upstream, f'{step.method}_async')(*step.args, **step.kwargs)
+    if isinstance(step, Compute):
+        return await run_cpu(step.func, *step.args)
+    return await run_async(step, upstream, run_cpu)
@@ -0,0 +1,79 @@
+"""对本地服务做并发压测，比较同步 WSGI 与异步 ASGI 模式的单进程并发能力
+
+先以模拟数据源启动服务（每个请求使用不同的股票代码，避免命中缓存）：
+
+    UPSTREAM_SOURCE=fake FAKE_UPSTREAM_LATENCY=0.2 UPSTREAM_RATE=1000 UPSTREAM_BURST=1000 \\
+        UPSTREAM_CONCURRENCY=256 PRICE_STORE=off gunicorn -w 1 -b 127.0.0.1:5001 app:app
+
+    UPSTREAM_SOURCE=fake FAKE_UPSTREAM_LATENCY=0.2 UPSTREAM_RATE=1000 UPSTREAM_BURST=1000 \\
+        UPSTREAM_CONCURRENCY=256 PRICE_STORE=off hypercorn -w 1 -b 127.0.0.1:5001 asgi:app
+
+然后运行：
+
+    python loadtest.py --url http://127.0.0.1:5001 --concurrency 64 --requests 256
+"""
+import argparse
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=120) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, time.perf_counter() - start
+
+
+def busy_seconds(base_url):
+    """从 /api/metrics 读取所有请求的累计处理时间"""
+    with urllib.request.urlopen(base_url + '/api/metrics', timeout=120) as response:
+        text = response.read().decode()
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('finrisk_request_duration_seconds_sum'))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--path', default='/api/risk/{symbol}', help='请求路径模板，{symbol}替换为不同的股票代码')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=256)
+    args = parser.parse_args()
+
+    run_id = int(time.time())
+    urls = [args.url + args.path.format(symbol=f'LT{run_id}X{i}') for i in range(args.requests)]
+
+    busy_before = busy_seconds(args.url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(fetch, urls))
+    elapsed = time.perf_counter() - start
+    busy = busy_seconds(args.url) - busy_before
+
+    latencies = [latency for status, latency in results if status == 200]
+    errors = len(results) - len(latencies)
+    print(f'请求数: {len(results)}  成功: {len(latencies)}  失败: {errors}')
+    print(f'总耗时: {elapsed:.2f}s  吞吐: {len(results) / elapsed:.1f} req/s')
+    if latencies:
+        print(f'延迟 p50: {percentile(latencies, 0.5) * 1000:.0f}ms  '
+              f'p95: {percentile(latencies, 0.95) * 1000:.0f}ms  '
+              f'max: {max(latencies) * 1000:.0f}ms')
+    # Little定律：服务端平均并发 = 服务端累计处理时间 / 总耗时（不含连接排队）
+    print(f'单进程平均并发请求数: {busy / elapsed:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,452 @@
+import atexit
+import copy
+import fcntl
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+from flask.json.provider import DefaultJSONProvider
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 当前请求的路由，用于给阶段耗时打标签；后台任务（如预热器）没有请求上下文
+current_route = ContextVar('current_route', default='background')
+
+
+def default_metrics_dir():
+    """与共享价格存储一样优先使用 /dev/shm"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'finrisk-metrics')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """返回 (后缀, 标签, 值) 列表"""
+        with self._lock:
+            return [('', dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def dump(self):
+        """导出为可写入快照文件的字典"""
+        with self._lock:
+            values = [[list(key), copy.deepcopy(value)] for key, value in self._values.items()]
+        return {'name': self.name, 'help': self.help, 'type': self.type,
+                'labelnames': list(self.labelnames), 'values': values}
+
+    def merge(self, values, pid=None):
+        """累加另一个进程导出的值"""
+        with self._lock:
+            for key, value in values:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """multiprocess_mode 决定多进程合并方式：sum 求和，max 取最大值，all 按 pid 标签分别导出"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), multiprocess_mode='sum'):
+        super().__init__(name, help, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def dump(self):
+        return {**super().dump(), 'mode': self.multiprocess_mode}
+
+    def merge(self, values, pid=None):
+        if self.multiprocess_mode == 'sum':
+            return super().merge(values)
+        with self._lock:
+            for key, value in values:
+                key = tuple(key)
+                if self.multiprocess_mode == 'all':
+                    key += (str(pid),)
+                    self._values[key] = value
+                else:
+                    self._values[key] = max(self._values.get(key, value), value)
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, state in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, state['buckets']):
+                    result.append(('_bucket', {**labels, 'le': format_value(bound)}, count))
+                result.append(('_sum', labels, state['sum']))
+                result.append(('_count', labels, state['count']))
+        return result
+
+    def dump(self):
+        return {**super().dump(), 'buckets': list(self.buckets[:-1])}
+
+    def merge(self, values, pid=None):
+        with self._lock:
+            for key, value in values:
+                state = self._values.setdefault(tuple(key), {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                state['buckets'] = [a + b for a, b in zip(state['buckets'], value['buckets'])]
+                state['sum'] += value['sum']
+                state['count'] += value['count']
+
+
+def restore_metric(record):
+    """根据快照中的描述创建空的同名指标"""
+    labelnames = record['labelnames']
+    if record['type'] == 'histogram':
+        return Histogram(record['name'], record['help'], labelnames, record['buckets'])
+    if record['type'] == 'gauge':
+        if record['mode'] == 'all':
+            labelnames = labelnames + ['pid']
+        return Gauge(record['name'], record['help'], labelnames, record['mode'])
+    return Counter(record['name'], record['help'], labelnames)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_snapshots(snapshots):
+    """合并多个进程的快照；计数器与直方图累加，仪表只取仍在运行的进程"""
+    merged = {}
+    for snapshot in snapshots:
+        for record in snapshot['metrics']:
+            if record['type'] == 'gauge' and not snapshot['live']:
+                continue
+            metric = merged.get(record['name'])
+            if metric is None:
+                metric = merged[record['name']] = restore_metric(record)
+            metric.merge(record['values'], snapshot['pid'])
+    return list(merged.values())
+
+
+class Registry:
+    """指标注册表，以Prometheus文本格式导出"""
+
+    ARCHIVE = 'archive.json'
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self.multiprocess_dir = None
+        self.flush_interval = 5
+        self._flushed_at = 0
+        self._snapshot_name = None
+        self._flusher_pid = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), multiprocess_mode='sum'):
+        return self.register(Gauge(name, help, labelnames, multiprocess_mode))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """注册采集函数，每次导出时调用，返回Metric列表"""
+        self._collectors.append(collect)
+
+    def collect(self):
+        metrics = list(self._metrics)
+        for collect in self._collectors:
+            metrics.extend(collect())
+        return metrics
+
+    def enable_multiprocess(self, directory, flush_interval=5):
+        """多worker部署时每个进程把指标快照写入共享目录，导出时合并所有进程"""
+        os.makedirs(directory, exist_ok=True)
+        self.multiprocess_dir = directory
+        self.flush_interval = flush_interval
+        atexit.register(self.flush)
+
+    def _snapshot_path(self):
+        # 文件名带随机后缀，fork出的子进程或复用的pid不会覆盖已退出进程的快照
+        pid = os.getpid()
+        if self._snapshot_name is None or self._snapshot_name[0] != pid:
+            self._snapshot_name = (pid, f'{pid}-{uuid.uuid4().hex[:8]}.json')
+        return os.path.join(self.multiprocess_dir, self._snapshot_name[1])
+
+    def _write(self, path, snapshot):
+        tmp = os.path.join(self.multiprocess_dir, f'.tmp-{uuid.uuid4().hex}')
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def flush(self):
+        """把本进程的指标写入共享目录"""
+        if self.multiprocess_dir is None:
+            return
+        self._flushed_at = time.monotonic()
+        self._write(self._snapshot_path(), {'pid': os.getpid(), 'metrics': [m.dump() for m in self.collect()]})
+
+    def maybe_flush(self):
+        """距上次写入超过 flush_interval 时写入快照，在每个请求结束时调用；
+        同时确保本进程有后台线程定期写入，空闲worker最后的计数也不会滞留在进程内"""
+        if self.multiprocess_dir is None:
+            return
+        if self._flusher_pid != os.getpid():
+            # fork不会复制线程，每个worker在处理第一个请求时启动自己的线程
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                # 目录暂时不可写时保留进程内的值，下次再写
+                continue
+
+    def _read_snapshots(self):
+        own = os.path.basename(self._snapshot_path())
+        snapshots = []
+        for name in sorted(os.listdir(self.multiprocess_dir), key=lambda n: n != own):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.multiprocess_dir, name)
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            snapshot['path'] = path
+            snapshot['live'] = name != self.ARCHIVE and pid_alive(snapshot['pid'])
+            snapshots.append(snapshot)
+        return snapshots
+
+    def merged(self):
+        """合并共享目录中所有进程的快照；已退出进程的计数器归档到 archive.json，保证累计值不回退"""
+        self.flush()
+        archive_path = os.path.join(self.multiprocess_dir, self.ARCHIVE)
+        with open(os.path.join(self.multiprocess_dir, 'archive.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshots = self._read_snapshots()
+            finished = [s for s in snapshots if not s['live']]
+            exited = [s for s in finished if s['path'] != archive_path]
+            if exited:
+                self._write(archive_path, {'pid': None, 'metrics': [m.dump() for m in merge_snapshots(finished)]})
+                for snapshot in exited:
+                    os.remove(snapshot['path'])
+            return merge_snapshots(snapshots)
+
+    def render(self):
+        metrics = self.collect() if self.multiprocess_dir is None else self.merged()
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram('finrisk_request_duration_seconds', '请求耗时', ['route'])
+REQUESTS = registry.counter('finrisk_requests_total', '请求数', ['route', 'method', 'status'])
+IN_FLIGHT = registry.gauge('finrisk_requests_in_flight', '处理中的请求数')
+STAGE_DURATION = registry.histogram('finrisk_stage_duration_seconds', '各阶段耗时', ['route', 'stage'])
+MODEL_FITS = registry.counter('finrisk_model_fits_total', '模型训练次数', ['model'])
+ERRORS = registry.counter('finrisk_errors_total', '错误数', ['route', 'type'])
+
+
+@contextmanager
+def stage(name):
+    """记录一个处理阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, route=current_route.get(), stage=name)
+
+
+def timed(name):
+    """装饰器形式的stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """记录响应序列化耗时；Quart 使用同一个 JSON provider 基类，两种模式共用"""
+
+    def response(self, *args, **kwargs):
+        with stage('serialize'):
+            return super().response(*args, **kwargs)
+
+
+def record_error(error_type):
+    ERRORS.inc(route=current_route.get(), type=error_type)
+
+
+# 当前请求的采样标识，异步模式下随上下文传到计算线程
+profiled_request = ContextVar('profiled_request', default=None)
+
+
+class SamplingProfiler:
+    """采样分析器：定期采样处理中请求的调用栈，慢请求输出为火焰图可用的折叠栈文件"""
+
+    def __init__(self, threshold, output_dir, interval=0.005):
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.interval = interval
+        self._stacks = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def begin(self, track_thread=True):
+        """开始采样当前请求；异步模式下事件循环线程由所有请求共享，只采样 attach 的计算线程"""
+        token = object()
+        with self._lock:
+            self._stacks[token] = StackCounter()
+            if track_thread:
+                self._threads[threading.get_ident()] = token
+        profiled_request.set(token)
+
+    @contextmanager
+    def attach(self):
+        """把当前线程的调用栈计入发起计算的请求"""
+        token = profiled_request.get()
+        ident = threading.get_ident()
+        with self._lock:
+            if token in self._stacks:
+                self._threads[ident] = token
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._threads.get(ident) is token:
+                    del self._threads[ident]
+
+    def end(self, duration, label):
+        """结束当前请求的采样，超过阈值时写出折叠栈，返回文件路径"""
+        token = profiled_request.get()
+        with self._lock:
+            stacks = self._stacks.pop(token, None)
+            for ident in [i for i, t in self._threads.items() if t is token]:
+                del self._threads[ident]
+        if not stacks or duration < self.threshold:
+            return None
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label).strip('_')
+        path = os.path.join(self.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{safe_label}.folded")
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._threads:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, token in self._threads.items():
+                    frame = frames.get(thread_id)
+                    names = []
+                    while frame is not None:
+                        code = frame.f_code
+                        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                        frame = frame.f_back
+                    if names:
+                        self._stacks[token][';'.join(reversed(names))] += 1
@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# 紧凑列式存储：价格使用float32，成交量与时间戳使用int64
+COLUMNS = {
+    'Open': np.float32,
+    'High': np.float32,
+    'Low': np.float32,
+    'Close': np.float32,
+    'Volume': np.int64
+}
+CURRENT = 'CURRENT'
+# 代码与周期会成为目录名，只接受Yahoo代码使用的字符（如 ^GSPC、BRK-B、EURUSD=X、0700.HK）
+SYMBOL_PATTERN = re.compile(r'[A-Z0-9^][A-Z0-9.^=-]{0,31}')
+INTERVAL_PATTERN = re.compile(r'[0-9]{1,3}[a-z]{1,3}')
+
+
+def default_root():
+    """优先使用 /dev/shm（内存文件系统），否则回退到临时目录"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'finrisk-prices')
+
+
+class PriceArrays:
+    """某个股票与周期的只读价格数组，列为零拷贝的内存映射视图"""
+
+    def __init__(self, meta, timestamps, columns):
+        self.meta = meta
+        self.timestamps = timestamps
+        self.columns = columns
+
+    @property
+    def period(self):
+        return self.meta['period']
+
+    @property
+    def age(self):
+        return time.time() - self.meta['published_at']
+
+    def to_frame(self, start=None):
+        """转换为DataFrame，start为UTC纳秒时间戳时只转换其后的数据"""
+        offset = int(np.searchsorted(self.timestamps, start)) if start is not None else 0
+        index = pd.to_datetime(self.timestamps[offset:], utc=True)
+        index = index.tz_convert(self.meta['tz']) if self.meta['tz'] else index.tz_localize(None)
+        return pd.DataFrame(
+            {name: np.asarray(values[offset:], dtype=np.float64 if name != 'Volume' else np.int64)
+             for name, values in self.columns.items()},
+            index=index
+        )
+
+
+class SharedPriceStore:
+    """跨进程共享的价格数组存储
+
+    每个 (股票, 周期) 的每个版本是一个目录，列以 .npy 文件保存并以
+    mmap 方式读取，同一台机器上的所有 worker 共享同一份物理内存。
+    发布时先写临时目录再原子重命名，最后原子替换 CURRENT 索引文件，
+    读者始终看到完整的旧版本或新版本。
+    """
+
+    def __init__(self, root=None, keep_versions=2, max_bytes=64 * 1024 * 1024, max_idle=86400,
+                 sweep_interval=60):
+        self.root = root or default_root()
+        self.keep_versions = keep_versions
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.sweep_interval = sweep_interval
+        self._views = {}
+        self._touched = {}
+        self._last_sweep = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def accepts(symbol, interval):
+        """代码与周期能否安全地作为目录名"""
+        return bool(SYMBOL_PATTERN.fullmatch(symbol.upper()) and INTERVAL_PATTERN.fullmatch(interval))
+
+    def _key_dir(self, symbol, interval):
+        if not self.accepts(symbol, interval):
+            raise ValueError(f'无效的股票代码或周期: {symbol!r} {interval!r}')
+        return os.path.join(self.root, symbol.upper(), interval)
+
+    def _touch(self, key_dir):
+        # 目录的修改时间记录最近一次读取，用于跨进程的LRU与过期清理；每分钟最多更新一次
+        now = time.monotonic()
+        with self._lock:
+            if now - self._touched.get(key_dir, -60) < 60:
+                return
+            self._touched[key_dir] = now
+        try:
+            os.utime(key_dir)
+        except FileNotFoundError:
+            pass
+
+    def publish(self, symbol, interval, data, period):
+        """发布新版本的价格数据，替换当前版本"""
+        key_dir = self._key_dir(symbol, interval)
+        os.makedirs(key_dir, exist_ok=True)
+        version = f'{time.time_ns()}-{os.getpid()}'
+        tmp_dir = os.path.join(key_dir, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(tmp_dir)
+
+        index = data.index
+        tz = str(index.tz) if getattr(index, 'tz', None) is not None else None
+        timestamps = (index.tz_convert('UTC') if tz else index).as_unit('ns').asi8
+        arrays = {'timestamps': timestamps}
+        for name, dtype in COLUMNS.items():
+            arrays[name] = data[name].to_numpy(dtype=dtype, na_value=0 if name == 'Volume' else np.nan)
+        try:
+            for name, values in arrays.items():
+                np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(values))
+            os.rename(tmp_dir, os.path.join(key_dir, version))
+        except OSError:
+            # 例如 /dev/shm 已满，清理未完成的版本
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        nbytes = sum(values.nbytes for values in arrays.values())
+
+        meta = {
+            'symbol': symbol.upper(),
+            'interval': interval,
+            'period': period,
+            'version': version,
+            'rows': len(data),
+            'tz': tz,
+            'nbytes': nbytes,
+            'published_at': time.time()
+        }
+        current_tmp = os.path.join(key_dir, f'.{CURRENT}-{uuid.uuid4().hex}')
+        with open(current_tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(current_tmp, os.path.join(key_dir, CURRENT))
+        self._prune(key_dir)
+        self.sweep()
+        return meta
+
+    def _prune(self, key_dir):
+        # 已映射的文件在删除后仍对持有者有效，保留最近几个版本给正在打开的读者
+        versions = sorted((d for d in os.listdir(key_dir) if not d.startswith('.') and d != CURRENT),
+                          key=lambda d: int(d.split('-')[0]))
+        for old in versions[:-self.keep_versions]:
+            shutil.rmtree(os.path.join(key_dir, old), ignore_errors=True)
+
+    def sweep(self, force=False):
+        """清理长时间未读取的股票，总占用超过上限时按最近读取时间淘汰"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+
+        keys = []
+        for symbol in os.listdir(self.root):
+            symbol_dir = os.path.join(self.root, symbol)
+            try:
+                intervals = os.listdir(symbol_dir)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for interval in intervals:
+                key_dir = os.path.join(symbol_dir, interval)
+                meta = self._read_meta(key_dir)
+                try:
+                    used_at = os.stat(key_dir).st_mtime
+                except FileNotFoundError:
+                    continue
+                keys.append((used_at, key_dir, meta['nbytes'] if meta else 0))
+
+        total = sum(nbytes for _, _, nbytes in keys)
+        for used_at, key_dir, nbytes in sorted(keys):
+            if time.time() - used_at <= self.max_idle and total <= self.max_bytes:
+                break
+            shutil.rmtree(key_dir, ignore_errors=True)
+            total -= nbytes
+            try:
+                os.rmdir(os.path.dirname(key_dir))
+            except OSError:
+                pass
+
+        # 释放本进程对已清理或已替换版本的映射
+        with self._lock:
+            cached = list(self._views.items())
+        for (symbol, interval), arrays in cached:
+            meta = self._read_meta(self._key_dir(symbol, interval))
+            if meta is None or meta['version'] != arrays.meta['version']:
+                with self._lock:
+                    if self._views.get((symbol, interval)) is arrays:
+                        del self._views[(symbol, interval)]
+
+    def _read_meta(self, key_dir):
+        try:
+            with open(os.path.join(key_dir, CURRENT)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def read(self, symbol, interval):
+        """读取当前版本，返回PriceArrays；不存在时返回None"""
+        key_dir = self._key_dir(symbol, interval)
+        self.sweep()
+        for _ in range(2):
+            meta = self._read_meta(key_dir)
+            if meta is None:
+                with self._lock:
+                    self._views.pop((symbol.upper(), interval), None)
+                return None
+            self._touch(key_dir)
+            cache_key = (symbol.upper(), interval)
+            with self._lock:
+                cached = self._views.get(cache_key)
+            if cached is not None and cached.meta['version'] == meta['version']:
+                return cached
+            version_dir = os.path.join(key_dir, meta['version'])
+            try:
+                timestamps = np.load(os.path.join(version_dir, 'timestamps.npy'), mmap_mode='r')
+                columns = {c: np.load(os.path.join(version_dir, f'{c}.npy'), mmap_mode='r') for c in COLUMNS}
+            except FileNotFoundError:
+                # 读取索引后该版本恰好被替换并清理，重新读取索引
+                continue
+            arrays = PriceArrays(meta, timestamps, columns)
+            with self._lock:
+                self._views[cache_key] = arrays
+            return arrays
+        return None
+
+    def footprint(self):
+        """每个股票的内存占用"""
+        symbols = {}
+        for symbol in sorted(os.listdir(self.root)):
+            symbol_dir = os.path.join(self.root, symbol)
+            if not os.path.isdir(symbol_dir):
+                continue
+            intervals = {}
+            for interval in sorted(os.listdir(symbol_dir)):
+                meta = self._read_meta(os.path.join(symbol_dir, interval))
+                if meta is not None:
+                    intervals[interval] = {
+                        'rows': meta['rows'],
+                        'period': meta['period'],
+                        'bytes': meta['nbytes'],
+                        'age_seconds': round(time.time() - meta['published_at'], 1)
+                    }
+            if intervals:
+                symbols[symbol] = {
+                    'bytes': sum(i['bytes'] for i in intervals.values()),
+                    'intervals': intervals
+                }
+        return {
+            'root': self.root,
+            'total_bytes': sum(s['bytes'] for s in symbols.values()),
+            'symbols': symbols
+        }
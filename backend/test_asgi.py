@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+os.environ.setdefault('UPSTREAM_SOURCE', 'fake')
+os.environ.setdefault('PRICE_STORE', 'off')
+os.environ.setdefault('METRICS_MULTIPROCESS', 'off')
+
+import app as core  # noqa: E402
+import asgi  # noqa: E402
+from handlers import run_async, run_sync  # noqa: E402
+from upstream import FakeUpstream, UpstreamError, UpstreamScheduler  # noqa: E402
+
+LATENCY = 0.2
+
+
+class PartlyBroken(FakeUpstream):
+    """BAD 的行情请求失败，其余股票正常"""
+
+    def history(self, symbol, period='1y', interval='1d'):
+        if symbol == 'BAD':
+            self._simulate()
+            raise ConnectionError('上游连接失败 (fake)')
+        return super().history(symbol, period, interval)
+
+
+def scheduler(source):
+    return UpstreamScheduler(source, rate=1000, burst=1000, max_concurrency=16, retries=0)
+
+
+def run_timed(handler, upstream):
+    async def main():
+        started = time.perf_counter()
+        result = await run_async(handler, upstream, asgi.run_cpu)
+        return result, time.perf_counter() - started
+    return asyncio.run(main())
+
+
+def test_risk_fetches_stock_and_benchmark_concurrently():
+    source = FakeUpstream(latency=LATENCY)
+    result, elapsed = run_timed(core.handle_risk_analysis('AAPL', {'period': '6mo'}), scheduler(source))
+    assert result['symbol'] == 'AAPL'
+    assert source.calls == 2
+    assert elapsed < LATENCY * 1.75
+
+
+def test_compare_fetches_all_symbols_concurrently_and_skips_failures():
+    source = PartlyBroken(latency=LATENCY)
+    data = {'symbols': ['AAPL', 'BAD', 'MSFT', 'TSLA'], 'period': '6mo'}
+    result, elapsed = run_timed(core.handle_compare(data), scheduler(source))
+    assert [entry['symbol'] for entry in result['comparison']] == ['AAPL', 'MSFT', 'TSLA']
+    assert elapsed < LATENCY * 1.75
+
+
+def test_sync_and_async_handlers_return_the_same_data():
+    upstream = scheduler(FakeUpstream(latency=0))
+    sync = run_sync(core.handle_kline('AAPL', {'interval': '1d', 'period': '3mo'}), upstream)
+    async_result, _ = run_timed(core.handle_kline('AAPL', {'interval': '1d', 'period': '3mo'}), upstream)
+    assert sync == async_result
+
+
+def test_upstream_failure_reaches_both_runners():
+    source = FakeUpstream(latency=0)
+    source.fail_next(2)
+    upstream = scheduler(source)
+    with pytest.raises(UpstreamError):
+        run_sync(core.handle_hourly_data('AAPL'), upstream)
+    with pytest.raises(UpstreamError):
+        run_timed(core.handle_hourly_data('AAPL'), upstream)
+
+
+@pytest.mark.parametrize('path', ['/api/user-predict/AAPL', '/api/price-store/footprint', '/api/search/AAPL'])
+def test_routes_match_between_front_ends(path):
+    async def fetch_async():
+        response = await asgi.app.test_client().get(path)
+        return response.status_code, await response.get_json()
+
+    response = core.app.test_client().get(path)
+    assert (response.status_code, response.get_json()) == asyncio.run(fetch_async())
+
+
+def test_user_prediction_errors_are_handled_in_both_front_ends(monkeypatch):
+    def broken(symbol):
+        raise RuntimeError('预测数据损坏')
+
+    monkeypatch.setattr(core, 'latest_user_prediction', broken)
+
+    async def fetch_async():
+        response = await asgi.app.test_client().get('/api/user-predict/AAPL')
+        return response.status_code, await response.get_json()
+
+    response = core.app.test_client().get('/api/user-predict/AAPL')
+    assert (response.status_code, response.get_json()) == (500, {'error': '预测数据损坏'})
+    assert asyncio.run(fetch_async()) == (500, {'error': '预测数据损坏'})
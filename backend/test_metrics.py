@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+
+import pytest
+
+from metrics import Registry
+
+os.environ.setdefault('UPSTREAM_SOURCE', 'fake')
+os.environ.setdefault('PRICE_STORE', 'off')
+os.environ.setdefault('METRICS_MULTIPROCESS', 'off')
+
+
+def worker_registry(directory=None):
+    registry = Registry()
+    registry.counter('jobs_total', '任务数', ['kind']).inc(2, kind='a')
+    registry.gauge('busy', '处理中').set(1)
+    registry.gauge('ratio', '命中率', multiprocess_mode='all').set(0.5)
+    registry.histogram('latency_seconds', '耗时', buckets=(0.1, 1)).observe(0.5)
+    if directory:
+        registry.enable_multiprocess(directory)
+    return registry
+
+
+def finish_worker(directory):
+    worker_registry(directory).flush()
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    registry.counter('jobs_total', '任务数', ['kind']).inc(kind='a"b')
+    registry.gauge('busy', '处理中').set(3)
+    registry.histogram('latency_seconds', '耗时', ['route'], buckets=(0.1, 1)).observe(0.5, route='/x')
+    assert registry.render() == '\n'.join([
+        '# HELP jobs_total 任务数',
+        '# TYPE jobs_total counter',
+        'jobs_total{kind="a\\"b"} 1.0',
+        '# HELP busy 处理中',
+        '# TYPE busy gauge',
+        'busy 3.0',
+        '# HELP latency_seconds 耗时',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/x",le="0.1"} 0.0',
+        'latency_seconds_bucket{route="/x",le="1.0"} 1.0',
+        'latency_seconds_bucket{route="/x",le="+Inf"} 1.0',
+        'latency_seconds_sum{route="/x"} 0.5',
+        'latency_seconds_count{route="/x"} 1.0',
+    ]) + '\n'
+
+
+def test_render_merges_live_workers(tmp_path):
+    first = worker_registry(str(tmp_path))
+    second = worker_registry(str(tmp_path))
+    second.flush()
+    output = first.render()
+    assert 'jobs_total{kind="a"} 4.0' in output
+    assert 'busy 2.0' in output
+    assert f'ratio{{pid="{os.getpid()}"}} 0.5' in output
+    assert 'latency_seconds_count 2.0' in output
+    assert 'latency_seconds_bucket{le="1.0"} 2.0' in output
+
+
+def test_exited_worker_counters_are_archived(tmp_path):
+    context = multiprocessing.get_context('fork')
+    process = context.Process(target=finish_worker, args=(str(tmp_path),))
+    process.start()
+    process.join()
+    registry = worker_registry(str(tmp_path))
+    for _ in range(2):
+        output = registry.render()
+        assert 'jobs_total{kind="a"} 4.0' in output
+        assert 'busy 1.0' in output
+    assert sorted(os.listdir(tmp_path)) == sorted(['archive.json', 'archive.lock',
+                                                   os.path.basename(registry._snapshot_path())])
+
+
+@pytest.fixture(scope='module')
+def client():
+    import app
+    return app.app.test_client()
+
+
+def test_risk_request_records_each_stage_once(client):
+    from metrics import STAGE_DURATION
+
+    def counts():
+        return {labels['stage']: value for suffix, labels, value in STAGE_DURATION.samples()
+                if suffix == '_count' and labels['route'] == '/api/risk/<symbol>'}
+
+    before = counts()
+    assert client.get('/api/risk/AAPL').status_code == 200
+    after = counts()
+    for name in ['returns', 'metrics', 'serialize']:
+        assert after[name] - before.get(name, 0) == 1
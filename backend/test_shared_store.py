@@ -0,0 +1,111 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from shared_store import SharedPriceStore
+from upstream import FakeUpstream, UpstreamScheduler, period_start
+
+
+def frame(symbol='AAPL', period='1y'):
+    return FakeUpstream(latency=0).history(symbol, period=period)
+
+
+@pytest.mark.parametrize('symbol', ['..', '.', '../ETC', 'A/B', '', 'A' * 40])
+def test_rejects_unsafe_symbols(tmp_path, symbol):
+    store = SharedPriceStore(str(tmp_path / 'prices'))
+    assert not store.accepts(symbol, '1d')
+    with pytest.raises(ValueError):
+        store.publish(symbol, '1d', frame(), '1y')
+    assert os.listdir(tmp_path) == ['prices']
+
+
+@pytest.mark.parametrize('symbol', ['AAPL', '^GSPC', 'BRK-B', 'EURUSD=X', '0700.HK'])
+def test_accepts_yahoo_symbols(tmp_path, symbol):
+    assert SharedPriceStore(str(tmp_path)).accepts(symbol, '1h')
+
+
+def test_scheduler_bypasses_store_for_unsafe_symbols(tmp_path):
+    store = SharedPriceStore(str(tmp_path / 'prices'))
+    upstream = UpstreamScheduler(FakeUpstream(latency=0), price_store=store)
+    assert not upstream.history('..', period='1y').empty
+    assert os.listdir(tmp_path) == ['prices']
+    assert os.listdir(tmp_path / 'prices') == []
+
+
+def test_evicts_least_recently_read_over_cap(tmp_path):
+    data = frame()
+    store = SharedPriceStore(str(tmp_path), sweep_interval=0)
+    size = store.publish('AAA', '1d', data, '1y')['nbytes']
+    store.max_bytes = size * 2
+    store.publish('BBB', '1d', data, '1y')
+    old = time.time() - 3600
+    os.utime(tmp_path / 'AAA' / '1d', (old, old))
+    store.publish('CCC', '1d', data, '1y')
+    assert sorted(store.footprint()['symbols']) == ['BBB', 'CCC']
+    assert store.read('AAA', '1d') is None
+
+
+def test_evicts_idle_symbols(tmp_path):
+    store = SharedPriceStore(str(tmp_path), max_idle=60, sweep_interval=0)
+    store.publish('AAA', '1d', frame(), '1y')
+    old = time.time() - 120
+    os.utime(tmp_path / 'AAA' / '1d', (old, old))
+    store.sweep(force=True)
+    assert store.footprint()['symbols'] == {}
+
+
+def test_publish_failure_returns_data_uncached(tmp_path, monkeypatch):
+    store = SharedPriceStore(str(tmp_path))
+
+    def full(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(store, 'publish', full)
+    upstream = UpstreamScheduler(FakeUpstream(latency=0), price_store=store)
+    data = upstream.history('AAPL', period='3mo')
+    assert not data.empty
+    assert store.read('AAPL', '1d') is None
+
+
+class LongHistory(FakeUpstream):
+    """返回2000年至今的日线，用于检查max周期"""
+
+    def history(self, symbol, period='1y', interval='1d'):
+        self._simulate()
+        index = pd.bdate_range('2000-01-03', pd.Timestamp.now().normalize())
+        if period != 'max':
+            index = index[index >= pd.Timestamp(period_start(period), tz='UTC').tz_localize(None)]
+        close = np.linspace(100, 200, len(index))
+        return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close,
+                             'Volume': np.full(len(index), 1000)}, index=index)
+
+
+def test_max_period_is_not_truncated(tmp_path):
+    source = LongHistory(latency=0)
+    upstream = UpstreamScheduler(source, price_store=SharedPriceStore(str(tmp_path)))
+    first = upstream.history('AAPL', period='max')
+    second = upstream.history('AAPL', period='max')
+    assert first.index[0] == pd.Timestamp('2000-01-03')
+    pd.testing.assert_frame_equal(first, second)
+    assert source.calls == 1
+
+
+def test_ten_years_does_not_cover_max(tmp_path):
+    source = LongHistory(latency=0)
+    upstream = UpstreamScheduler(source, price_store=SharedPriceStore(str(tmp_path)))
+    upstream.history('AAPL', period='10y')
+    assert upstream.history('AAPL', period='max').index[0] == pd.Timestamp('2000-01-03')
+    assert source.calls == 2
+    upstream.history('AAPL', period='1y')
+    assert source.calls == 2
+
+
+def test_miss_and_hit_return_identical_prices(tmp_path):
+    store = SharedPriceStore(str(tmp_path))
+    miss = UpstreamScheduler(FakeUpstream(latency=0), price_store=store).history('AAPL', period='6mo')
+    hit = UpstreamScheduler(FakeUpstream(latency=0), price_store=store).history('AAPL', period='6mo')
+    pd.testing.assert_frame_equal(miss, hit)
+    assert (miss['Close'] == miss['Close'].astype(np.float32)).all()
@@ -0,0 +1,176 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+import requests
+
+from upstream import (
+    FakeUpstream, MemoryCache, UpstreamError, UpstreamScheduler, UpstreamThrottled, YahooUpstream
+)
+
+
+def fake_transport(monkeypatch, status=None, body=b'', error=None):
+    """替换HTTP传输层，所有请求返回指定状态码或抛出网络错误"""
+    def send(adapter, request, **kwargs):
+        if error is not None:
+            raise error
+        response = requests.Response()
+        response.status_code = status
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', send)
+
+
+def scheduler(source):
+    return UpstreamScheduler(source, rate=1000, burst=1000, retries=2, backoff=0.001, max_backoff=0.001)
+
+
+def test_yahoo_429_is_throttled(monkeypatch):
+    fake_transport(monkeypatch, status=429, body=b'Too Many Requests')
+    with pytest.raises(UpstreamThrottled):
+        YahooUpstream().history('AAPL', period='1y')
+
+
+def test_yahoo_connection_error_is_upstream_error(monkeypatch):
+    fake_transport(monkeypatch, error=requests.ConnectionError('connection refused'))
+    with pytest.raises(UpstreamError):
+        YahooUpstream().history('AAPL', period='1y')
+
+
+def test_yahoo_unknown_symbol_is_empty(monkeypatch):
+    body = json.dumps({'chart': {'result': None, 'error': {
+        'code': 'Not Found', 'description': 'No data found, symbol may be delisted'}}}).encode()
+    fake_transport(monkeypatch, status=404, body=body)
+    assert YahooUpstream().history('NOSUCHSYMBOL', period='1y').empty
+
+
+def test_yahoo_invalid_period_is_empty_without_retry(monkeypatch):
+    body = json.dumps({'chart': {'result': [{'meta': {'validRanges': ['1d', '5d', '1y']}}], 'error': None}}).encode()
+    fake_transport(monkeypatch, status=200, body=body)
+    upstream = scheduler(YahooUpstream())
+    assert upstream.history('AAPL', period='bogus').empty
+    assert upstream.stats()['retries'] == 0
+
+
+def test_scheduler_retries_429_and_serves_stale(monkeypatch):
+    fake_transport(monkeypatch, status=429, body=b'Too Many Requests')
+    upstream = scheduler(YahooUpstream())
+    stale = pd.DataFrame({'Close': [1.0, 2.0]})
+    key = ('history', 'AAPL', '1y', '1d')
+    upstream._cache.store(key, stale)
+    upstream._cache.lookup(key).fetched_at -= upstream.revalidate_ttl + 1
+
+    assert upstream.history('AAPL', period='1y') is stale
+    stats = upstream.stats()
+    assert stats['throttle_events'] == 3
+    assert stats['retries'] == 2
+    assert stats['stale_served'] == 1
+
+
+def test_scheduler_raises_without_stale_entry(monkeypatch):
+    fake_transport(monkeypatch, status=429, body=b'Too Many Requests')
+    upstream = scheduler(YahooUpstream())
+    with pytest.raises(UpstreamError):
+        upstream.history('AAPL', period='1y')
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2)
+    cache.store('a', 1)
+    cache.store('b', 2)
+    cache.lookup('a')
+    cache.store('c', 3)
+    assert cache.lookup('b') is None
+    assert cache.lookup('a').value == 1
+    assert len(cache) == 2
+
+
+def test_memory_cache_drops_expired_entries():
+    cache = MemoryCache(max_age=10)
+    cache.store('a', 1)
+    cache.lookup('a').fetched_at -= 11
+    assert cache.lookup('a') is None
+    assert len(cache) == 0
+
+
+class RecoveredTicker:
+    """模拟yfinance在429后换cookie策略重试成功"""
+
+    def __init__(self, symbol, session=None):
+        self.symbol = symbol
+        self.session = session
+
+    @property
+    def info(self):
+        self.session._local.throttled = True
+        return {'symbol': self.symbol, 'longName': 'Apple Inc.'}
+
+
+def test_yahoo_info_recovered_from_429_is_returned(monkeypatch):
+    monkeypatch.setattr('upstream.yf.Ticker', RecoveredTicker)
+    assert YahooUpstream().info('AAPL')['longName'] == 'Apple Inc.'
+
+
+class ThrottledTicker(RecoveredTicker):
+    """模拟重试后仍被限流，yfinance返回空的info"""
+
+    @property
+    def info(self):
+        self.session._local.throttled = True
+        return {'trailingPegRatio': None}
+
+
+def test_yahoo_unusable_info_after_429_is_throttled(monkeypatch):
+    monkeypatch.setattr('upstream.yf.Ticker', ThrottledTicker)
+    with pytest.raises(UpstreamThrottled):
+        YahooUpstream().info('AAPL')
+
+
+class BrokenSource(FakeUpstream):
+
+    def history(self, symbol, period='1y', interval='1d'):
+        self._simulate()
+        raise KeyError('chart')
+
+
+def test_scheduler_does_not_retry_permanent_errors():
+    source = BrokenSource(latency=0)
+    upstream = scheduler(source)
+    with pytest.raises(KeyError):
+        upstream.history('AAPL')
+    assert source.calls == 1
+    assert upstream.stats()['retries'] == 0
+
+
+def test_scheduler_retries_transient_errors():
+    source = FakeUpstream(latency=0)
+    source.fail_next(2)
+    upstream = scheduler(source)
+    assert not upstream.history('AAPL').empty
+    assert source.calls == 3
+
+
+def test_concurrent_misses_share_one_fetch():
+    source = FakeUpstream(latency=0.2)
+    upstream = scheduler(source)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: upstream.history('SPY'), range(8)))
+    assert source.calls == 1
+    assert all(result is results[0] for result in results)
+    assert upstream.stats()['coalesced'] == 7
+
+
+def test_concurrent_misses_share_failure():
+    source = FakeUpstream(latency=0.2)
+    source.fail_next(3)
+    upstream = scheduler(source)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(upstream.history, 'SPY') for _ in range(4)]
+    for future in futures:
+        with pytest.raises(UpstreamError):
+            future.result()
+    assert source.calls == 3
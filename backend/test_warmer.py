@@ -0,0 +1,145 @@
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+import pytest
+
+from upstream import FakeUpstream, UpstreamError, UpstreamScheduler
+from warmer import AnalyticsWarmer, MarketCalendar, WarmEntry, WarmStore
+
+NY = ZoneInfo('America/New_York')
+# 2026-10-16 是周五，2026-10-19 是周一
+FRIDAY = date(2026, 10, 16)
+
+
+def at(day, hour, minute=0):
+    return datetime(2026, 10, day, hour, minute, tzinfo=NY)
+
+
+@pytest.fixture
+def warmer(tmp_path):
+    return AnalyticsWarmer(lambda symbol: None, ['AAPL'], MarketCalendar(), store=WarmStore(str(tmp_path)))
+
+
+def friday_entry(computed_at):
+    return WarmEntry(datetime(2026, 10, 16, tzinfo=NY), {}, computed_at)
+
+
+@pytest.mark.parametrize('now, expected', [
+    (at(16, 10), True),
+    (at(16, 9, 29), False),
+    (at(16, 16), False),
+    (at(17, 12), False),
+    (at(19, 12), False)
+])
+def test_calendar_is_open(now, expected):
+    calendar = MarketCalendar(holidays=[date(2026, 10, 19)])
+    assert calendar.is_open(now) is expected
+
+
+@pytest.mark.parametrize('now, expected', [
+    (at(16, 12), FRIDAY),
+    (at(17, 12), FRIDAY),
+    (at(19, 8), FRIDAY),
+    (at(19, 12), FRIDAY),
+    (at(20, 8), FRIDAY),
+    (at(20, 10), date(2026, 10, 20))
+])
+def test_last_session_day_skips_weekends_holidays_and_pre_open(now, expected):
+    calendar = MarketCalendar(holidays=[date(2026, 10, 19)])
+    assert calendar.last_session_day(now) == expected
+
+
+def test_sessions_between_skips_weekends():
+    assert MarketCalendar().sessions_between(FRIDAY, date(2026, 10, 20)) == 2
+
+
+@pytest.mark.parametrize('now', [at(16, 16, 30), at(18, 12), at(19, 9)])
+def test_result_from_partial_bar_is_stale_after_close(warmer, now):
+    assert not warmer.is_fresh(friday_entry(at(16, 15, 57)), now)
+
+
+@pytest.mark.parametrize('now', [at(16, 16, 30), at(18, 12), at(19, 9)])
+def test_result_after_settle_is_fresh_until_next_open(warmer, now):
+    assert warmer.is_fresh(friday_entry(at(16, 16, 20)), now)
+
+
+def test_result_is_stale_once_next_session_opens(warmer):
+    assert not warmer.is_fresh(friday_entry(at(16, 16, 20)), at(19, 9, 31))
+
+
+def test_intraday_result_expires_after_interval(warmer):
+    entry = friday_entry(at(16, 10))
+    assert warmer.is_fresh(entry, at(16, 10, 4))
+    assert not warmer.is_fresh(entry, at(16, 10, 6))
+
+
+def test_settle_window_uses_interval(warmer):
+    entry = friday_entry(at(16, 16, 2))
+    assert warmer.is_fresh(entry, at(16, 16, 5))
+    assert not warmer.is_fresh(entry, at(16, 16, 30))
+
+
+def test_post_close_refresh_is_scheduled(warmer):
+    warmer.store.save('AAPL', datetime(2026, 10, 16, tzinfo=NY), {'risk': {}}, at(16, 15, 57))
+    assert warmer.is_due('AAPL', ['risk'], at(16, 16, 30))
+
+
+def test_computed_at_is_when_fetching_started(warmer):
+    fetched = []
+
+    def refresh(symbol):
+        fetched.append(datetime.now().astimezone())
+        return pd.Timestamp(FRIDAY, tz=NY), {'risk': {'beta': 1.0}}
+
+    warmer.refresh = refresh
+    warmer._refresh_symbol('AAPL')
+    assert warmer.store.load('AAPL')['risk'].computed_at <= fetched[0]
+
+
+def test_refresh_fetch_skips_cache_and_stale_fallback():
+    source = FakeUpstream(latency=0)
+    upstream = UpstreamScheduler(source, retries=0)
+    upstream.history('AAPL')
+    upstream.history('AAPL', refresh=True)
+    assert source.calls == 2
+    source.fail_next()
+    with pytest.raises(UpstreamError):
+        upstream.history('AAPL', refresh=True)
+
+
+def test_only_one_process_leads(tmp_path):
+    store_root = str(tmp_path)
+    first = AnalyticsWarmer(lambda symbol: None, ['AAPL'], store=WarmStore(store_root))
+    second = AnalyticsWarmer(lambda symbol: None, ['AAPL'], store=WarmStore(store_root))
+    assert first.is_leader()
+    assert not second.is_leader()
+    first.stop()
+    assert second.is_leader()
+    second.stop()
+
+
+def test_hits_are_shared_and_only_count_watchlist(tmp_path):
+    leader = AnalyticsWarmer(lambda symbol: None, ['AAPL', 'MSFT'], store=WarmStore(str(tmp_path)))
+    worker = AnalyticsWarmer(lambda symbol: None, ['AAPL', 'MSFT'], store=WarmStore(str(tmp_path)))
+    for _ in range(3):
+        worker.get('msft', 'risk')
+    worker.get('TSLA', 'risk')
+    worker.flush_hits()
+    leader.get('MSFT', 'risk')
+    leader.flush_hits()
+    assert leader.hits() == {'MSFT': 4}
+    assert leader.prioritized() == ['MSFT', 'AAPL']
+
+
+def test_refresh_status_is_visible_from_other_workers(tmp_path):
+    def refresh(symbol):
+        raise UpstreamError('上游不可用')
+
+    leader = AnalyticsWarmer(refresh, ['AAPL'], store=WarmStore(str(tmp_path)))
+    worker = AnalyticsWarmer(refresh, ['AAPL'], store=WarmStore(str(tmp_path)))
+    leader._refresh_symbol('AAPL')
+    report = worker.report()['symbols'][0]
+    assert report['last_error'] == '上游不可用'
+    assert report['last_attempt'] is not None
+    assert not report['refreshing']
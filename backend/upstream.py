@@ -0,0 +1,575 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import requests
+import yfinance as yf
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道：数值越小越先调度
+INTERACTIVE = 0
+BATCH = 1
+WARMUP = 2
+LANES = {INTERACTIVE: 'interactive', BATCH: 'batch', WARMUP: 'warmup'}
+
+PERIOD_DAYS = {
+    '1d': 1, '5d': 5, '1mo': 31, '3mo': 92, '6mo': 183,
+    '1y': 365, '2y': 730, '5y': 1826, '10y': 3652, 'max': 3652
+}
+# 与Yahoo一致，这些周期按最近的交易日计算，其余周期按自然日计算
+SESSION_PERIODS = ('1d', '5d')
+# max 没有起点，PERIOD_DAYS 中的天数只用于模拟数据源
+UNBOUNDED_PERIOD = 'max'
+
+THROTTLE_MARKERS = ('too many requests', 'rate limit', '429')
+# 无效代码、无数据或无效周期属于输入问题而非故障
+EMPTY_MARKERS = ('no data found', 'delisted', 'no timezone found', 'no price data found', 'is invalid')
+# info 中至少包含其一才视为有效结果
+INFO_KEYS = ('symbol', 'quoteType', 'shortName', 'longName')
+
+
+class UpstreamError(Exception):
+    """数据源请求在重试后仍然失败"""
+
+
+class UpstreamThrottled(UpstreamError):
+    """数据源限流"""
+
+
+# 可重试的暂时性错误；解析错误等其他异常重试也不会成功，直接抛出
+TRANSIENT_ERRORS = (UpstreamError, requests.RequestException, ConnectionError, TimeoutError)
+
+
+class RecordingSession(requests.Session):
+    """记录当前线程本次调用中的HTTP状态与网络错误
+
+    yfinance 会吞掉限流与网络错误，统一报告为"No price data found"，
+    只能在传输层判断失败的真实原因。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.throttled = False
+        self._local.error = None
+
+    def request(self, *args, **kwargs):
+        try:
+            response = super().request(*args, **kwargs)
+        except requests.RequestException as e:
+            self._local.error = e
+            raise
+        if response.status_code == 429:
+            self._local.throttled = True
+        elif response.status_code >= 500:
+            self._local.error = f'HTTP {response.status_code}'
+        return response
+
+    def raise_for_failure(self):
+        """本次调用遇到限流或网络错误时抛出对应异常"""
+        if getattr(self._local, 'throttled', False):
+            raise UpstreamThrottled('429 Too Many Requests')
+        error = getattr(self._local, 'error', None)
+        if error is not None:
+            raise UpstreamError(f'上游请求失败: {error}')
+
+
+class YahooUpstream:
+    """Yahoo Finance 数据源"""
+
+    def __init__(self):
+        self.session = RecordingSession()
+
+    def history(self, symbol, period='1y', interval='1d'):
+        self.session.reset()
+        try:
+            return yf.Ticker(symbol, session=self.session).history(period=period, interval=interval, raise_errors=True)
+        except Exception as e:
+            self.session.raise_for_failure()
+            message = str(e).lower()
+            if any(marker in message for marker in THROTTLE_MARKERS):
+                raise UpstreamThrottled(str(e)) from e
+            # 无效代码、无数据或无效周期不是故障，与原有行为一致返回空表
+            if any(marker in message for marker in EMPTY_MARKERS):
+                return pd.DataFrame()
+            raise
+
+    def info(self, symbol):
+        self.session.reset()
+        try:
+            info = yf.Ticker(symbol, session=self.session).info
+        except Exception as e:
+            self.session.raise_for_failure()
+            if any(marker in str(e).lower() for marker in THROTTLE_MARKERS):
+                raise UpstreamThrottled(str(e)) from e
+            raise
+        # yfinance 会对 4xx/5xx 换一种cookie策略重试，只有结果不可用时才说明请求确实失败
+        if not any(key in (info or {}) for key in INFO_KEYS):
+            self.session.raise_for_failure()
+        return info
+
+
+class FakeUpstream:
+    """本地模拟数据源，可注入延迟、故障与限流，用于测试"""
+
+    def __init__(self, latency=0.05, failure_rate=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._scheduled = []
+        self._lock = threading.Lock()
+
+    def fail_next(self, count=1, throttle=False):
+        """让接下来的count次调用失败"""
+        with self._lock:
+            self._scheduled.extend([throttle] * count)
+
+    def _simulate(self):
+        with self._lock:
+            self.calls += 1
+            scheduled = self._scheduled.pop(0) if self._scheduled else None
+            roll = self._random.random()
+        time.sleep(self.latency)
+        if scheduled is True or (scheduled is None and roll < self.throttle_rate):
+            raise UpstreamThrottled('429 Too Many Requests (fake)')
+        if scheduled is False or (scheduled is None and roll < self.throttle_rate + self.failure_rate):
+            raise ConnectionError('上游连接失败 (fake)')
+
+    def history(self, symbol, period='1y', interval='1d'):
+        self._simulate()
+        end = pd.Timestamp.now(tz='America/New_York').floor('h')
+        start = pd.Timestamp(period_start(period if period in PERIOD_DAYS else '1y'), tz='America/New_York')
+        if interval == '1h':
+            index = pd.date_range(start, end, freq='h')
+            index = index[(index.dayofweek < 5) & (index.hour >= 9) & (index.hour <= 15)]
+        else:
+            freq = {'1wk': 'W-MON', '1mo': 'MS'}.get(interval, 'B')
+            index = pd.date_range(start.normalize(), end.normalize(), freq=freq)
+        if period in SESSION_PERIODS:
+            index = index[np.isin(index.date, last_sessions(index, period))]
+
+        # 按代码生成确定性的随机游走
+        rng = np.random.default_rng(zlib.crc32(symbol.upper().encode()))
+        close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, len(index))))
+        open_ = close * (1 + rng.normal(0, 0.004, len(index)))
+        return pd.DataFrame({
+            'Open': open_,
+            'High': np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, len(index))),
+            'Low': np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, len(index))),
+            'Close': close,
+            'Volume': rng.integers(1_000_000, 50_000_000, len(index))
+        }, index=index)
+
+    def info(self, symbol):
+        self._simulate()
+        symbol = symbol.upper()
+        return {
+            'symbol': symbol,
+            'longName': f'{symbol} Fake Inc.',
+            'currency': 'USD',
+            'exchange': 'FAKE',
+            'quoteType': 'EQUITY'
+        }
+
+
+class TokenBucket:
+    """令牌桶限速，需在调用方的锁内使用"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """取出一个令牌，返回0；令牌不足时返回需要等待的秒数"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def penalize(self, seconds):
+        """被限流时清空令牌，让所有请求暂停一段时间"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+def period_start(period):
+    """周期起点的UTC纳秒时间戳，按交易日计算的周期留出周末与节假日的余量"""
+    days = PERIOD_DAYS[period]
+    if period in SESSION_PERIODS:
+        days = days * 2 + 7
+    return (pd.Timestamp.now(tz='UTC') - timedelta(days=days)).value
+
+
+def last_sessions(index, period):
+    """索引中最近的若干个交易日"""
+    return sorted(set(index.date))[-PERIOD_DAYS[period]:]
+
+
+def covers(stored, requested):
+    """已存储的周期能否覆盖请求的周期，只有max能覆盖max"""
+    if stored == UNBOUNDED_PERIOD:
+        return True
+    if requested == UNBOUNDED_PERIOD:
+        return False
+    return PERIOD_DAYS.get(stored, 0) >= PERIOD_DAYS[requested]
+
+
+def slice_period(data, period):
+    """从更长的历史数据中截取指定周期"""
+    if period == UNBOUNDED_PERIOD:
+        return data
+    if period in SESSION_PERIODS:
+        return data[np.isin(data.index.date, last_sessions(data.index, period))]
+    start = pd.Timestamp(period_start(period), tz='UTC')
+    if data.index.tz is None:
+        start = start.tz_localize(None)
+    return data[data.index >= start]
+
+
+class CacheEntry:
+
+    def __init__(self, value):
+        self.value = value
+        self.fetched_at = time.monotonic()
+
+    @property
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+
+class MemoryCache:
+    """进程内LRU缓存，条目数有上限，超过max_age的条目不再使用并被清理"""
+
+    def __init__(self, max_entries=1024, max_age=86400):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.age > self.max_age:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key, value):
+        # 空结果（无效代码）不作为有效数据缓存
+        if not (isinstance(value, pd.DataFrame) and value.empty):
+            with self._lock:
+                self._entries[key] = CacheEntry(value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+
+class SharedHistoryEntry:
+
+    def __init__(self, arrays, period):
+        self.arrays = arrays
+        self.period = period
+
+    @property
+    def age(self):
+        return self.arrays.age
+
+    @property
+    def value(self):
+        if self.period == UNBOUNDED_PERIOD:
+            return self.arrays.to_frame()
+        frame = self.arrays.to_frame(start=period_start(self.period))
+        return slice_period(frame, self.period) if self.period in SESSION_PERIODS else frame
+
+
+class SharedHistoryCache:
+    """以共享价格数组为后端的行情缓存，较短周期从已存储的较长周期中截取"""
+
+    def __init__(self, price_store, symbol, interval, period):
+        self.price_store = price_store
+        self.symbol = symbol
+        self.interval = interval
+        self.period = period
+        self.arrays = price_store.read(symbol, interval)
+        self.covered = self.arrays is not None and covers(self.arrays.period, period)
+        # 已存储更长周期时按原周期刷新，避免被较短的数据替换
+        self.fetch_period = self.arrays.period if self.covered else period
+
+    def lookup(self, key):
+        return SharedHistoryEntry(self.arrays, self.period) if self.covered else None
+
+    def store(self, key, value):
+        if value.empty:
+            return value
+        arrays = None
+        try:
+            self.price_store.publish(self.symbol, self.interval, value, self.fetch_period)
+            arrays = self.price_store.read(self.symbol, self.interval)
+        except OSError as e:
+            # 共享存储写入失败（如 /dev/shm 已满）时仍返回本次获取的数据，只是不缓存
+            logger.warning('共享价格存储写入失败 %s %s: %s', self.symbol, self.interval, e)
+        if arrays is None:
+            return slice_period(value, self.period) if self.fetch_period != self.period else value
+        # 返回从存储读回的float32数据，未命中与命中时的结果完全一致
+        return SharedHistoryEntry(arrays, self.period).value
+
+
+class UpstreamScheduler:
+    """上游请求调度器：限速、并发上限、优先级通道、退避重试与过期数据回退"""
+
+    def __init__(self, source, rate=5.0, burst=10, max_concurrency=8, retries=3, backoff=0.5,
+                 max_backoff=8.0, queue_timeout=30.0, fresh_ttl=60, revalidate_ttl=600, stale_ttl=86400,
+                 price_store=None, io_workers=32, cache_entries=1024):
+        self.source = source
+        self.price_store = price_store
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue_timeout = queue_timeout
+        self.fresh_ttl = fresh_ttl
+        self.revalidate_ttl = revalidate_ttl
+        self.stale_ttl = stale_ttl
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._cache = MemoryCache(max_entries=cache_entries, max_age=stale_ttl)
+        self._revalidating = set()
+        self._flights = {}
+        self._revalidator = ThreadPoolExecutor(max_workers=2, thread_name_prefix='revalidate')
+        self._io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='upstream-io')
+        self._stats_lock = threading.Lock()
+        self._lanes = {name: {'requests': 0, 'queue_wait_sum': 0.0, 'queue_wait_max': 0.0} for name in LANES.values()}
+        self._counters = dict.fromkeys(
+            ['cache_hits', 'cache_misses', 'stale_served', 'revalidations', 'throttle_events',
+             'retries', 'failures', 'queue_timeouts', 'coalesced'], 0)
+
+    def history(self, symbol, period='1y', interval='1d', priority=INTERACTIVE, refresh=False):
+        """获取历史行情；refresh为True时跳过缓存与过期回退，保证数据在调用之后获取"""
+        symbol = symbol.upper()
+        key = ('history', symbol, period, interval)
+        with stage('upstream_fetch'):
+            if self.price_store is None or period not in PERIOD_DAYS or not self.price_store.accepts(symbol, interval):
+                fetch = lambda: self.source.history(symbol, period=period, interval=interval)
+                return self._cached(key, fetch, priority, refresh=refresh)
+
+            cache = SharedHistoryCache(self.price_store, symbol, interval, period)
+            fetch = lambda: self.source.history(symbol, period=cache.fetch_period, interval=interval)
+            return self._cached(key, fetch, priority, cache, refresh)
+
+    def info(self, symbol, priority=INTERACTIVE):
+        """获取股票基本信息"""
+        symbol = symbol.upper()
+        with stage('upstream_fetch'):
+            return self._cached(('info', symbol), lambda: self.source.info(symbol), priority)
+
+    async def history_async(self, symbol, period='1y', interval='1d', priority=INTERACTIVE):
+        """可等待的history，在I/O线程池中执行，不阻塞事件循环"""
+        return await self._run_async(self.history, symbol, period, interval, priority)
+
+    async def info_async(self, symbol, priority=INTERACTIVE):
+        """可等待的info"""
+        return await self._run_async(self.info, symbol, priority)
+
+    async def _run_async(self, func, *args):
+        # 复制上下文，使阶段耗时仍记在当前请求的路由下
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._io_pool, context.run, func, *args)
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._counters[name] += amount
+
+    def _cached(self, key, fetch, priority, cache=None, refresh=False):
+        cache = cache or self._cache
+        if refresh:
+            # 只与同样要求刷新的请求合并，不共享调用之前已开始的获取
+            return self._single_flight(('refresh',) + key, lambda: cache.store(key, self._call(fetch, priority)))
+
+        entry = cache.lookup(key)
+        if entry is not None and entry.age <= self.fresh_ttl:
+            self._count('cache_hits')
+            return entry.value
+
+        # 稍旧的数据先返回，同时在后台以批处理优先级刷新
+        if entry is not None and entry.age <= self.revalidate_ttl:
+            self._count('stale_served')
+            self._revalidate(key, fetch, cache)
+            return entry.value
+
+        self._count('cache_misses')
+        try:
+            return self._single_flight(key, lambda: cache.store(key, self._call(fetch, priority)))
+        except UpstreamError:
+            if entry is not None and entry.age <= self.stale_ttl:
+                self._count('stale_served')
+                return entry.value
+            raise
+
+    def _single_flight(self, key, func):
+        """同一键的并发未命中只执行一次func，其余请求等待并共享结果或异常"""
+        with self._stats_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+            else:
+                self._counters['coalesced'] += 1
+        if not leader:
+            return flight.result()
+        try:
+            value = func()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(value)
+            return value
+        finally:
+            with self._stats_lock:
+                del self._flights[key]
+
+    def _revalidate(self, key, fetch, cache):
+        with self._stats_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                cache.store(key, self._call(fetch, BATCH))
+                self._count('revalidations')
+            except UpstreamError:
+                pass
+            except Exception:
+                logger.exception('后台刷新失败 %s', key)
+            finally:
+                with self._stats_lock:
+                    self._revalidating.discard(key)
+
+        self._revalidator.submit(run)
+
+    def _call(self, fetch, priority):
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count('retries')
+                time.sleep(self._backoff_delay(attempt))
+            self._acquire(priority)
+            try:
+                return fetch()
+            except UpstreamThrottled as e:
+                last_error = e
+                self._count('throttle_events')
+                with self._cond:
+                    self._bucket.penalize(self._backoff_delay(attempt + 1))
+            except TRANSIENT_ERRORS as e:
+                last_error = e
+            finally:
+                self._release()
+        self._count('failures')
+        raise UpstreamError(str(last_error)) from last_error
+
+    def _backoff_delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _acquire(self, priority):
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    self._count('queue_timeouts')
+                    raise UpstreamError('上游请求排队超时')
+                if self._waiting[0] == ticket and self._in_flight < self.max_concurrency:
+                    delay = self._bucket.take()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(min(delay, remaining))
+                else:
+                    self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._in_flight += 1
+            self._cond.notify_all()
+
+        waited = time.monotonic() - start
+        with self._stats_lock:
+            lane = self._lanes[LANES.get(priority, 'batch')]
+            lane['requests'] += 1
+            lane['queue_wait_sum'] += waited
+            lane['queue_wait_max'] = max(lane['queue_wait_max'], waited)
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """调度器运行指标"""
+        with self._cond:
+            in_flight = self._in_flight
+            waiting = len(self._waiting)
+        with self._stats_lock:
+            lanes = {name: dict(lane) for name, lane in self._lanes.items()}
+            counters = dict(self._counters)
+        for lane in lanes.values():
+            lane['queue_wait_avg'] = lane['queue_wait_sum'] / lane['requests'] if lane['requests'] else 0.0
+        return {
+            'source': type(self.source).__name__,
+            'in_flight': in_flight,
+            'waiting': waiting,
+            'max_concurrency': self.max_concurrency,
+            'rate': self._bucket.rate,
+            'cached_entries': len(self._cache),
+            'lanes': lanes,
+            **counters
+        }
+
+
+def create_source(name, **fake_options):
+    """根据名称创建数据源"""
+    if name == 'fake':
+        return FakeUpstream(**fake_options)
+    return YahooUpstream()
@@ -0,0 +1,353 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+
+class MarketCalendar:
+    """交易日历：判断开市状态与最近交易日"""
+
+    def __init__(self, tz='America/New_York', open_time=time(9, 30), close_time=time(16, 0), holidays=(),
+                 settle_delay=timedelta(minutes=15)):
+        self.tz = ZoneInfo(tz)
+        self.open_time = open_time
+        self.close_time = close_time
+        self.holidays = set(holidays)
+        self.settle_delay = settle_delay
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def is_session_day(self, day):
+        return day.weekday() < 5 and day not in self.holidays
+
+    def is_open(self, now=None):
+        now = (now or self.now()).astimezone(self.tz)
+        return self.is_session_day(now.date()) and self.open_time <= now.time() < self.close_time
+
+    def last_session_day(self, now=None):
+        """最近一个已开盘的交易日，即最新日K线应对应的日期"""
+        now = (now or self.now()).astimezone(self.tz)
+        day = now.date()
+        if not self.is_session_day(day) or now.time() < self.open_time:
+            day -= timedelta(days=1)
+        while not self.is_session_day(day):
+            day -= timedelta(days=1)
+        return day
+
+    def settled_at(self, day):
+        """该交易日收盘并经过结算延迟的时刻，此后日K线不再变化"""
+        return datetime.combine(day, self.close_time, self.tz) + self.settle_delay
+
+    def sessions_between(self, start, end):
+        """统计 (start, end] 区间内的交易日数量"""
+        count = 0
+        day = start + timedelta(days=1)
+        while day <= end:
+            if self.is_session_day(day):
+                count += 1
+            day += timedelta(days=1)
+        return count
+
+
+class WarmEntry:
+    """预计算结果，以最后一根K线的时间戳为键；computed_at 为开始获取输入数据的时刻"""
+
+    def __init__(self, last_bar, payload, computed_at=None):
+        self.last_bar = last_bar
+        self.payload = payload
+        self.computed_at = computed_at or datetime.now().astimezone()
+
+
+def default_root():
+    """与共享价格存储一样优先使用 /dev/shm"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'finrisk-warmer')
+
+
+def json_default(value):
+    # numpy标量等转换为Python原生类型
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class WarmStore:
+    """跨进程共享的预热数据：每个股票的结果、访问次数与刷新状态各为一个JSON文件，
+    写临时文件后原子替换，所有worker读到同一份数据"""
+
+    def __init__(self, root=None):
+        self.root = root or default_root()
+        self._cache = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, f'{name}.json')
+
+    def _write(self, name, data):
+        tmp = os.path.join(self.root, f'.{name}-{uuid.uuid4().hex}')
+        with open(tmp, 'w') as f:
+            json.dump(data, f, default=json_default)
+        os.replace(tmp, self._path(name))
+
+    def _read(self, name, parse, default):
+        """读取并解析JSON文件，文件未被替换时复用已解析的结果"""
+        try:
+            st = os.stat(self._path(name))
+        except FileNotFoundError:
+            return default
+        version = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._cache.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        try:
+            with open(self._path(name)) as f:
+                parsed = parse(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+        with self._lock:
+            self._cache[name] = (version, parsed)
+        return parsed
+
+    def save(self, symbol, last_bar, results, computed_at):
+        self._write(symbol, {
+            'last_bar': last_bar.isoformat(),
+            'computed_at': computed_at.isoformat(),
+            'results': results
+        })
+
+    def load(self, symbol):
+        """返回 {类型: WarmEntry}"""
+        def parse(record):
+            last_bar = datetime.fromisoformat(record['last_bar'])
+            computed_at = datetime.fromisoformat(record['computed_at'])
+            return {kind: WarmEntry(last_bar, payload, computed_at) for kind, payload in record['results'].items()}
+        return self._read(symbol, parse, {})
+
+    def add_hits(self, counts):
+        """把本进程新增的访问次数累加到共享计数，文件锁避免多个进程互相覆盖"""
+        with open(os.path.join(self.root, 'hits.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            hits = dict(self.hits())
+            for symbol, count in counts.items():
+                hits[symbol] = hits.get(symbol, 0) + count
+            self._write('hits', hits)
+
+    def hits(self):
+        return self._read('hits', dict, {})
+
+    def save_status(self, status):
+        self._write('status', status)
+
+    def status(self):
+        """执行预热的进程写入的刷新状态"""
+        return self._read('status', dict, {})
+
+
+class AnalyticsWarmer:
+    """后台预热器：按访问频率优先级为自选列表预计算分析结果"""
+
+    def __init__(self, refresh, watchlist=(), calendar=None, workers=4, interval=300, store=None):
+        self.refresh = refresh
+        self.watchlist = [s.upper() for s in watchlist]
+        self.calendar = calendar or MarketCalendar()
+        self.workers = workers
+        self.interval = interval
+        self.store = store or WarmStore()
+        self._leader_fd = None
+        self._errors = {}
+        self._last_attempt = {}
+        self._pending_hits = Counter()
+        self.served = 0
+        self.missed = 0
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def record_access(self, symbol):
+        with self._lock:
+            self._pending_hits[symbol] += 1
+
+    def flush_hits(self):
+        """把本进程的访问次数写入共享计数"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, Counter()
+        if pending:
+            self.store.add_hits(pending)
+
+    def hits(self):
+        """所有worker的访问次数，包括本进程尚未写入的部分"""
+        hits = Counter(self.store.hits())
+        with self._lock:
+            hits.update(self._pending_hits)
+        return hits
+
+    def get(self, symbol, kind):
+        """返回新鲜的预计算结果，不在自选列表、不存在或已过期时返回None"""
+        symbol = symbol.upper()
+        if symbol not in self.watchlist:
+            return None
+        self.record_access(symbol)
+        entry = self.store.load(symbol).get(kind)
+        fresh = entry is not None and self.is_fresh(entry)
+        with self._lock:
+            if fresh:
+                self.served += 1
+            else:
+                self.missed += 1
+        return entry.payload if fresh else None
+
+    def bar_day(self, entry):
+        last_bar = entry.last_bar
+        if getattr(last_bar, 'tzinfo', None) is not None:
+            last_bar = last_bar.astimezone(self.calendar.tz)
+        return last_bar.date()
+
+    def is_fresh(self, entry, now=None):
+        now = now or self.calendar.now()
+        session_day = self.calendar.last_session_day(now)
+        if self.bar_day(entry) < session_day:
+            return False
+        settled_at = self.calendar.settled_at(session_day)
+        # 盘中及收盘结算前日K线持续变化，超过刷新间隔即视为过期
+        if now < settled_at:
+            return (now - entry.computed_at).total_seconds() <= self.interval
+        # 收盘后只有在结算之后计算的结果才基于完整的日K线
+        return entry.computed_at >= settled_at
+
+    def is_due(self, symbol, kinds, now=None):
+        entries = self.store.load(symbol)
+        return any(kind not in entries or not self.is_fresh(entries[kind], now) for kind in kinds)
+
+    def prioritized(self):
+        """按所有worker的访问次数降序排列自选列表"""
+        hits = self.hits()
+        order = {s: i for i, s in enumerate(self.watchlist)}
+        return sorted(self.watchlist, key=lambda s: (-hits.get(s, 0), order[s]))
+
+    def run_cycle(self, kinds=('risk', 'quantitative', 'predict')):
+        """提交所有需要刷新的股票，返回本轮提交的列表"""
+        now = self.calendar.now()
+        submitted = []
+        for symbol in self.prioritized():
+            with self._lock:
+                if symbol in self._in_flight or not self.is_due(symbol, kinds, now):
+                    continue
+                self._in_flight.add(symbol)
+            self._pool.submit(self._refresh_symbol, symbol)
+            submitted.append(symbol)
+        if submitted:
+            self._publish_status()
+        return submitted
+
+    def _refresh_symbol(self, symbol):
+        try:
+            # 刷新任务不使用缓存，结果的时间以开始获取数据的时刻为准
+            started_at = datetime.now().astimezone()
+            with self._lock:
+                self._last_attempt[symbol] = started_at
+            last_bar, results = self.refresh(symbol)
+            self.store.save(symbol, last_bar, results, started_at)
+            with self._lock:
+                self._errors.pop(symbol, None)
+        except Exception as e:
+            with self._lock:
+                self._errors[symbol] = str(e)
+        finally:
+            with self._lock:
+                self._in_flight.discard(symbol)
+            self._publish_status()
+
+    def _publish_status(self):
+        # 刷新状态写入共享存储，任何worker的 /api/warmer/status 都能看到
+        with self._lock:
+            self.store.save_status({
+                'leader_pid': os.getpid(),
+                'refreshing': sorted(self._in_flight),
+                'last_attempt': {s: t.isoformat() for s, t in self._last_attempt.items()},
+                'errors': dict(self._errors)
+            })
+
+    def is_leader(self):
+        """同一台机器上只有持有锁文件的进程运行预热，其余worker只读取共享结果；
+        持有者退出后锁自动释放，由其他进程接替"""
+        if self._leader_fd is None:
+            fd = os.open(os.path.join(self.store.root, 'leader.lock'), os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._leader_fd = fd
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.flush_hits()
+            if self.is_leader():
+                self.run_cycle()
+            self._stop.wait(min(60, self.interval))
+
+    def start(self):
+        if self._thread is not None or not self.watchlist:
+            return
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='warmer')
+        self._thread = threading.Thread(target=self._loop, name='warmer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._leader_fd is not None:
+            os.close(self._leader_fd)
+            self._leader_fd = None
+
+    def report(self):
+        """每个股票的新鲜度与滞后报告"""
+        now = self.calendar.now()
+        expected_day = self.calendar.last_session_day(now)
+        hits = self.hits()
+        status = self.store.status()
+
+        symbols = []
+        for symbol in self.prioritized():
+            kinds = {}
+            for kind, entry in self.store.load(symbol).items():
+                bar_day = self.bar_day(entry)
+                kinds[kind] = {
+                    'last_bar': entry.last_bar.isoformat(),
+                    'computed_at': entry.computed_at.isoformat(),
+                    'age_seconds': round((now - entry.computed_at).total_seconds(), 1),
+                    'sessions_behind': self.calendar.sessions_between(bar_day, expected_day),
+                    'fresh': self.is_fresh(entry, now)
+                }
+            symbols.append({
+                'symbol': symbol,
+                'hits': hits.get(symbol, 0),
+                'refreshing': symbol in status.get('refreshing', []),
+                'last_attempt': status.get('last_attempt', {}).get(symbol),
+                'last_error': status.get('errors', {}).get(symbol),
+                'fresh': bool(kinds) and all(k['fresh'] for k in kinds.values()),
+                'lag_seconds': max((k['age_seconds'] for k in kinds.values()), default=None),
+                'results': kinds
+            })
+
+        return {
+            'running': self._thread is not None and not self._stop.is_set(),
+            'leader': self._leader_fd is not None,
+            'leader_pid': status.get('leader_pid'),
+            'market_open': self.calendar.is_open(now),
+            'expected_bar': expected_day.isoformat(),
+            'interval': self.interval,
+            'workers': self.workers,
+            'symbols': symbols
+        }